@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+
+import timeit
+
+import unitparser
+from unitparser.unit.Dimension import Dimension
+
+
+""" compare dimension_of with parse on expressions that differ only in their numbers,
+so that dimension_of evaluates the first one and finds the others by their tokens without numbers """
+def main():
+    parser = unitparser._get_parser()
+    expressions = [f"{i} kg m / s + {i + 1} N s" for i in range(100)]     # no powers, see dimension_of
+
+    for expression in expressions:
+        assert parser.dimension_of(expression) == Dimension.of(parser.parse(expression))
+    # unitless results keep their number, which must not be shared between different literals
+    assert parser.dimension_of("3").num == 3 and parser.dimension_of("4").num == 4
+
+    number = 20
+    t_parse = min(timeit.repeat(lambda: [parser.parse(e) for e in expressions], number=number, repeat=5))
+
+    # the cache is cleared on every run, otherwise only the lookups by string would be measured
+    def dimensions():
+        parser.dimension_cache.clear()
+        return [parser.dimension_of(e) for e in expressions]
+    t_dimension = min(timeit.repeat(dimensions, number=number, repeat=5))
+    per_expression = 1e6 / number / len(expressions)
+
+    print(f"parse:        {t_parse * per_expression:.3f} us/expression")
+    print(f"dimension_of: {t_dimension * per_expression:.3f} us/expression ({t_parse / t_dimension:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
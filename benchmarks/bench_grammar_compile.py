@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+
+import time
+
+from unitparser.parser.Lexer import LexerToken
+from unitparser.parser.Parser import Parser, GrammarRule
+
+
+""" grammar with 'levels' binary operators of increasing precedence and 'functions' function tokens """
+def make_grammar(levels, functions):
+    tokens = [LexerToken("num", ""), LexerToken("open", ""), LexerToken("close", ""), LexerToken("comma", "")]
+    tokens += [LexerToken(f"op{i}", "") for i in range(levels)]
+    tokens += [LexerToken(f"func{i}", "") for i in range(functions)]
+
+    rules = [GrammarRule("EXP", "EXP0")]
+    for i in range(levels):
+        rules.append(GrammarRule(f"EXP{i}", f"EXP{i + 1}"))
+        rules.append(GrammarRule(f"EXP{i}", f"EXP{i} op{i} EXP{i + 1}"))
+    rules.append(GrammarRule(f"EXP{levels}", "num"))
+    rules.append(GrammarRule(f"EXP{levels}", "open EXP close"))
+    for i in range(functions):
+        rules.append(GrammarRule(f"EXP{levels}", f"func{i} open ARGS close"))
+    rules.append(GrammarRule("ARGS", "EXP"))
+    rules.append(GrammarRule("ARGS", "ARGS comma EXP"))
+    return rules, tokens
+
+
+""" time grammar compilation, bypassing the table cache """
+def main():
+    print(f"{'rules':>6} {'states':>7} {'time [ms]':>10}")
+    for levels in (4, 8, 16, 32, 64):
+        rules, tokens = make_grammar(levels, levels)
+        start = time.perf_counter()
+        parser = Parser(rules, tokens, cache=False)
+        elapsed = time.perf_counter() - start
+        print(f"{len(rules):>6} {len(parser.table.data):>7} {elapsed * 1e3:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
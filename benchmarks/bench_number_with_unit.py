@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+
+import timeit
+
+import unitparser
+
+
+""" time the arithmetic operators of NumberWithUnit """
+def main():
+    force = unitparser.parse("3 kg m / s^2")
+    length = unitparser.parse("2 m")
+    root = unitparser.parse("5 m^(1/2)")
+    scalar = unitparser.parse("7")
+
+    cases = [
+        ("a + b", force, force),
+        ("a - b", force, force),
+        ("a * b", force, length),
+        ("a / b", force, length),
+        ("a * b (fractional)", root, length),
+        ("a ** 2", force, None),
+        ("a ** 0.5", force, None),
+        ("a ** b", length, scalar),
+        ("3 * a", force, None),
+        ("1 / a", force, None),
+        ("-a", force, None),
+        ("a == b", force, force),
+        ("a.is_unitless()", scalar, None),
+        ("str(a)", force, None),
+        ("repr(a)", root, None),
+    ]
+    number = 20000
+    for name, a, b in cases:
+        statement = name.split(" (")[0]
+        elapsed = min(timeit.repeat(statement, globals={"a": a, "b": b}, number=number, repeat=5))
+        print(f"{name:<20} {number / elapsed / 1e3:>8.1f} kops/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+
+import os
+import time
+
+import unitparser
+import unitparser.parallel
+
+
+""" values with units, every string occurs about four times """
+def workload(count):
+    units = ["km/hr", "m/s", "mm/ms", "cm/min"]
+    keys = [(i * 7919) % (count // 4 + 1) for i in range(count)]
+    return [f"{key * 0.01:.2f} {units[key % len(units)]}" for key in keys]
+
+
+""" parse the same workload with one to 'os.cpu_count()' worker processes, compared to a single process """
+def main():
+    strings = workload(200000)
+    start = time.perf_counter()
+    expected = unitparser.parse_many(strings)[0]
+    single = time.perf_counter() - start
+    print(f"single process  {len(strings) / single:>10.0f} values/s")
+
+    processes = 1
+    while processes <= os.cpu_count():
+        with unitparser.parallel.Pool(processes) as pool:
+            pool.parse_many(strings[:1000])     # start the workers
+            start = time.perf_counter()
+            results, errors = pool.parse_many(strings)
+            elapsed = time.perf_counter() - start
+            start = time.perf_counter()
+            pool.in_units_of(strings, "m/s")
+            elapsed_convert = time.perf_counter() - start
+        assert [repr(r) for r in results] == [repr(r) for r in expected]
+        print(f"{processes:>3} processes    {len(strings) / elapsed:>10.0f} values/s  "
+              f"speedup {single / elapsed:>5.2f}   in_units_of {len(strings) / elapsed_convert:>10.0f} values/s")
+        processes *= 2
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+
+import timeit
+
+import unitparser
+
+
+""" compare the object based LR driver with the compact table driver on pre-lexed input """
+def main():
+    parser = unitparser._get_parser()
+    expressions = [
+        "3.5 kg m^2 / s^2 + 200 sqrt(nN/EPa) * 4 mN + 2 (kW hr) / 7",
+        " + ".join(["(1 + 2) * 3 / 4"] * 50),
+    ]
+
+    for expression in expressions:
+        tokens = parser.lexer.lex(expression)
+        values = parser.values
+        assert parser.parser.parse(tokens, values=values) == parser.parser.parse_compact(tokens, values=values)
+
+        number = 200
+        t_table = min(timeit.repeat(lambda: parser.parser.parse(tokens, values=values), number=number, repeat=5))
+        t_compact = min(timeit.repeat(lambda: parser.parser.parse_compact(tokens, values=values), number=number, repeat=5))
+        per_token = 1e6 / number / len(tokens)
+
+        print(f"{len(tokens)} tokens: {expression[:40]}{'...' if len(expression) > 40 else ''}")
+        print(f"  ParseTable:        {t_table * per_token:.3f} us/token")
+        print(f"  CompactParseTable: {t_compact * per_token:.3f} us/token ({t_table / t_compact:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
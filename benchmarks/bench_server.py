@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import subprocess
+
+
+EXPRESSIONS = ["3 km / hr", "200 sqrt(nN/EPa)", "hbar c / eV", "sin(pi/6) m", "kg m^2 / s^2 + 4 J", "12.5 kW hr"]
+
+
+""" one connection sending 'count' in_units_of requests, with at most 'depth' requests in flight,
+returns the latencies of the requests """
+async def client(path, count, depth, index):
+    reader, writer = await asyncio.open_unix_connection(path)
+    sent = {}
+    latencies = []
+    window = asyncio.Semaphore(depth)
+
+    async def receive():
+        for _ in range(count):
+            response = json.loads(await reader.readline())
+            latencies.append(time.perf_counter() - sent.pop(response["id"]))
+            window.release()
+
+    receiver = asyncio.create_task(receive())
+    for i in range(count):
+        await window.acquire()
+        expr = f"{i % 97 + index} ({EXPRESSIONS[i % len(EXPRESSIONS)]})"    # some repeated, most distinct
+        sent[i] = time.perf_counter()
+        writer.write(json.dumps({"id": i, "op": "parse", "expr": expr}).encode() + b"\n")
+        await writer.drain()
+    await receiver
+    writer.close()
+    return latencies
+
+
+async def run(path, connections, count, depth):
+    start = time.perf_counter()
+    results = await asyncio.gather(*[client(path, count, depth, i) for i in range(connections)])
+    elapsed = time.perf_counter() - start
+    latencies = sorted(latency for result in results for latency in result)
+
+    reader, writer = await asyncio.open_unix_connection(path)
+    writer.write(b'{"op": "stats"}\n')
+    stats = json.loads(await reader.readline())["stats"]
+    writer.close()
+
+    def percentile(p):
+        return latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1e3
+    print(f"{connections:>3} connections x {count} requests, depth {depth}: {len(latencies) / elapsed:>8.0f} req/s  "
+          f"p50 {percentile(0.5):6.2f} ms  p99 {percentile(0.99):6.2f} ms  "
+          f"mean batch {stats['mean batch size']:.1f}")
+
+
+""" start the server in a separate process and measure latency and throughput with several concurrent clients """
+def main():
+    args = argparse.ArgumentParser()
+    args.add_argument("--requests", type=int, default=2000, help="requests per connection")
+    args.add_argument("--depth", type=int, default=16, help="requests in flight per connection")
+    args.add_argument("--connections", type=int, nargs="+", default=[1, 4, 16])
+    args = args.parse_args()
+
+    for connections in args.connections:
+        path = os.path.join(tempfile.mkdtemp(), "unitparser.sock")
+        server = subprocess.Popen([sys.executable, "-m", "unitparser.server", "--socket", path],
+                                  stderr=subprocess.DEVNULL)
+        try:
+            while not os.path.exists(path):
+                time.sleep(0.05)
+            asyncio.run(run(path, connections, args.requests, args.depth))
+        finally:
+            server.terminate()
+            server.wait()
+            os.unlink(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+
+import time
+import threading
+
+import unitparser
+
+
+EXPRESSIONS = ["3 km / hr", "200 sqrt(nN/EPa)", "hbar c / eV", "sin(pi/6) m", "kg m^2 / s^2 + 4 J"]
+DURATION = 1.0
+
+
+""" parse from several threads while another thread keeps registering functions,
+every result has to match the single threaded result, and every call of a registered function has to
+see either no function or the registered one, anything else would be an inconsistent lexer/config state """
+def run(num_threads):
+    parser = unitparser._get_parser()
+    expected = {data: repr(parser.parse(data)) for data in EXPRESSIONS}
+    errors = []
+    counts = [0] * num_threads
+    stop = threading.Event()
+
+    def reader(index):
+        i = 0
+        while not stop.is_set():
+            data = EXPRESSIONS[i % len(EXPRESSIONS)]
+            if repr(parser.parse(data)) != expected[data]:
+                errors.append(f"wrong result for {data}")
+            name = f"stress{i % 50}"
+            try:
+                if parser.parse(f"{name}(2)").num != 6:
+                    errors.append(f"wrong result for {name}")
+            except unitparser.UnitException as e:
+                if str(e) != f"Unknown unit: {name}":
+                    errors.append(str(e))
+            except Exception as e:
+                errors.append(f"{type(e).__name__}: {e}")
+            counts[index] += 2
+            i += 1
+
+    def writer():
+        i = 0
+        while not stop.is_set():
+            parser.add_function(f"stress{i % 50}", lambda x: 3 * x, 1, True)
+            i += 1
+            time.sleep(0.001)
+
+    threads = [threading.Thread(target=reader, args=(i,)) for i in range(num_threads)]
+    threads.append(threading.Thread(target=writer))
+    for thread in threads:
+        thread.start()
+    time.sleep(DURATION)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return sum(counts) / DURATION, errors
+
+
+def main():
+    print(f"{'threads':>7} {'parses/s':>10} {'errors':>7}")
+    for num_threads in (1, 2, 4, 8, 16):
+        throughput, errors = run(num_threads)
+        print(f"{num_threads:>7} {throughput:>10.0f} {len(errors):>7}")
+        for error in sorted(set(errors))[:5]:
+            print("   ", error)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,23 @@
+import threading
 from unitparser.parser.Lexer import LexerException
 from unitparser.parser.Parser import ParserException
-from unitparser.unit.UnitParser import UnitParser
+from unitparser.unit.UnitParser import UnitParser, ParseError
 from unitparser.unit.NumberWithUnit import UnitException
+from unitparser.unit.Converter import Converter
 
 
 __unit_parser = None
+__init_lock = threading.Lock()
 
 
 """ initialize parser,
-only necessary when using nonstandard config file """
-def init(path=None):
+only necessary when using nonstandard config file or to disable the files cached on disk with cache=False """
+def init(path=None, cache=True):
     global __unit_parser
     if __unit_parser is None:
-        __unit_parser = UnitParser(path)
+        with __init_lock:
+            if __unit_parser is None:
+                __unit_parser = UnitParser(path, cache)
 
 
 """ parse string and return internal representation """
@@ -20,6 +25,39 @@ def parse(data, debug=False):
     return _get_parser().parse(data, debug=debug)
 
 
+""" parse an iterable of strings without raising, returns two lists aligned with the input:
+the results and ParseError(kind, pos, exception) records, kind is one of "lexer", "syntax", "unit" or "error" """
+def parse_many(strings):
+    return _get_parser().parse_many(strings)
+
+
+""" unit of an expression without its value, e.g. to check that it is a length:
+dimension_of("3 km + 4 au") == dimension_of("m"), cheaper than parse, since numbers are not computed """
+def dimension_of(data):
+    return _get_parser().dimension_of(data)
+
+
+""" same as parse_many for dimension_of """
+def dimension_of_many(strings):
+    return _get_parser().dimension_of_many(strings)
+
+
+""" parse string once and return a callable, that takes a value for each name in 'variables',
+values can be numbers or objects constructed by 'parse', e.g.
+compile("x m/s * t", ["x", "t"])(3, parse("2 min")) """
+def compile(data, variables=()):
+    return _get_parser().compile(data, variables)
+
+
+""" create an array of numbers with a common unit, requires numpy,
+'values' can be any sequence or numpy array, 'unit' a string or an object constructed by 'parse' """
+def array(values, unit=None):
+    from unitparser.unit.ArrayWithUnit import ArrayWithUnit
+    if isinstance(unit, str):
+        unit = parse(unit)
+    return ArrayWithUnit.from_values(values, _get_parser().cfg, unit)
+
+
 """ express 'value' in units of 'reference',
 both can be either a string or and object constructed py 'parse',
 if the arguments don't have the same unit, an exception will be raised """
@@ -36,12 +74,62 @@ def in_units_of(value, reference):
     return result.num
 
 
+""" string of 'value' in the best fitting unit of the config, with prefix, e.g. format("3000 kg m/s^2") gives
+"3 kN", 'value' can be a string or an object constructed by 'parse', units without a matching derived unit
+are written in base units, with 'constants' set, constants like "c" are used as unit as well """
+def format(value, constants=False):
+    return _get_parser().format(value, constants)
+
+
+""" create a converter from units of 'source' to units of 'target', both can be a string or an object constructed
+by 'parse', the units are checked once, converter.convert(values) then only multiplies by a constant factor """
+def converter(source, target):
+    if isinstance(source, str):
+        source = parse(source)
+    if isinstance(target, str):
+        target = parse(target)
+    return Converter(source, target)
+
+
 """ add a function to the parser,
 a unitless function will receive numerical arguments, otherwise
 the function has to accept and return an internal representation """
 def add_function(name, function, num_args, unitless):
-    _get_parser().cfg.add_function(name, function, num_args, unitless)
-    _get_parser().update_functions()
+    _get_parser().add_function(name, function, num_args, unitless)
+
+
+""" cache up to 'max_size' parse results, 0 or None disables the cache (default) """
+def set_result_cache(max_size):
+    _get_parser().set_result_cache(max_size)
+
+
+""" hit and miss counters of the result cache and the cache of unit symbols """
+def cache_stats():
+    parser = _get_parser()
+    return {
+        "result": parser.result_cache.stats() if parser.result_cache is not None else None,
+        "unit": parser.cfg.unit_cache.stats()
+    }
+
+
+""" count and time the phases of parsing, 'callback' is called with a dictionary of measurements for every
+parsed string, e.g. to export them as metrics, disabled by default """
+def enable_instrumentation(callback=None):
+    _get_parser().enable_instrumentation(callback)
+
+
+def disable_instrumentation():
+    _get_parser().disable_instrumentation()
+
+
+""" counters and timers collected since instrumentation was enabled, None if it is disabled """
+def instrumentation_stats():
+    parser = _get_parser()
+    if parser.instrumentation is None:
+        return None
+    stats = parser.instrumentation.stats()
+    stats["caches"] = cache_stats()
+    return stats
 
 
 """ get the parser object, usually not necessary """
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+
+""" benchmarks of the hot paths, run with python -m unitparser.bench
+
+every case times a fixed workload, results are reported in operations per second, together with the number of
+memory blocks per operation, that one run of the workload allocates and that are still in use while its result is
+kept, i.e. the objects it builds and the growth of caches, temporary allocations are not included, since Python does
+not count them, the results can be saved as a baseline and compared against later, cases that got slower or allocate
+more than the tolerance allows are reported as regressions """
+
+import gc
+import os
+import sys
+import json
+import random
+import timeit
+import argparse
+from collections import namedtuple
+
+import unitparser
+from unitparser.unit import ConfigReader
+from unitparser.unit.UnitParser import UnitParser
+from unitparser.unit.NumberWithUnit import NumberWithUnit
+
+BASELINE_VERSION = 2
+
+EXPRESSIONS = [
+    "3.5 kg m^2 / s^2", "200 sqrt(nN/EPa) * 4 mN", "2 (kW hr) / 7", "hbar c / eV", "1.5e-3 kPa",
+    "sin(pi/6) m", "(3 m + 4 mm) / ms", "mu0 eps0 c^2", "9.81 m/s^2 * 70 kg", "log(8, 2) mol/L",
+]
+SYMBOLS = ["m", "kg", "mm", "kN", "GHz", "hbar", "Angstrom", "MPa", "Vs", "mJ"]
+DECOMPOSITIONS = ["Vs", "kWs", "Nm", "mAs", "kVA", "eVs", "Hzs", "Cmm"]
+
+Case = namedtuple("Case", ["name", "setup", "operations"])
+Result = namedtuple("Result", ["name", "ops", "blocks"])
+
+
+""" sums of numbers with the same unit, multiplied or divided by another number with unit,
+the seed makes the workload reproducible """
+def random_expressions(count, seed=0):
+    rng = random.Random(seed)
+    units = ["m", "s", "kg", "N", "J", "W", "A", "V", "km", "ms", "mol", "K", "kW hr", "m/s^2"]
+    expressions = []
+    for _ in range(count):
+        unit = rng.choice(units)
+        terms = [f"{rng.uniform(0.1, 100):.4g} {unit}" for _ in range(rng.randint(1, 3))]
+        op = rng.choice([" * ", " / ", " "])
+        expressions.append(f"({' + '.join(terms)}){op}{rng.uniform(0.1, 100):.4g} {rng.choice(units)}")
+    return expressions
+
+
+def lex_case():
+    lexer = unitparser._get_parser().lexer
+    workload = EXPRESSIONS + random_expressions(40)
+    return lambda: [lexer.lex(data) for data in workload]
+
+
+def parse_case():
+    parser = unitparser._get_parser()
+    workload = [parser.lexer.lex(data) for data in EXPRESSIONS + random_expressions(40)]
+    return lambda: [parser.parser.parse_compact(tokens, values=parser.values) for tokens in workload]
+
+
+def full_parse_case():
+    parser = unitparser._get_parser()
+    workload = EXPRESSIONS + random_expressions(40)
+    return lambda: [parser.parse(data) for data in workload]
+
+
+def arithmetic_case():
+    parse = unitparser.parse
+    force, length, root, scalar = parse("3 kg m / s^2"), parse("2 m"), parse("5 m^(1/2)"), parse("7")
+
+    def run():
+        a = force * length
+        b = a / length
+        c = b + force
+        d = c - force
+        e = root * root
+        f = length ** 2
+        g = force ** 0.5
+        h = 3 * force
+        i = scalar / force
+        return a, b, d, e, f, g, h, i, -force, force == b
+    return run
+
+
+def from_unit_case():
+    cfg = unitparser._get_parser().cfg
+
+    def run():
+        cfg.unit_cache.clear()
+        return [NumberWithUnit.from_unit(symbol, cfg) for symbol in SYMBOLS]
+    return run
+
+
+def from_unit_cached_case():
+    cfg = unitparser._get_parser().cfg
+    return lambda: [NumberWithUnit.from_unit(symbol, cfg) for symbol in SYMBOLS]
+
+
+def decomposition_case():
+    cfg = unitparser._get_parser().cfg
+    return lambda: [cfg.find_decomposition(data) for data in DECOMPOSITIONS]
+
+
+def in_units_of_case():
+    value, reference = unitparser.parse("3 km / hr"), unitparser.parse("m/s")
+    return lambda: unitparser.in_units_of(value, reference)
+
+
+def in_units_of_str_case():
+    return lambda: unitparser.in_units_of("3 km / hr", "m/s")
+
+
+def construction_case():
+    return lambda: UnitParser()
+
+
+def config_case(cache):
+    from unitparser import unit
+    path = os.path.join(unit.__path__[0], "config.json")
+    parser = unitparser._get_parser()
+
+    def run():
+        cfg = ConfigReader.ConfigReader(path, cache)
+        cfg.load_definitions(parser.identifiers, parser.evaluate_definition)
+        cfg.finalize()
+        return cfg
+    return run
+
+
+CASES = [
+    Case("lex", lex_case, 50),
+    Case("parse", parse_case, 50),
+    Case("lex+parse", full_parse_case, 50),
+    Case("arithmetic", arithmetic_case, 10),
+    Case("from_unit", from_unit_case, len(SYMBOLS)),
+    Case("from_unit (cached)", from_unit_cached_case, len(SYMBOLS)),
+    Case("find_decomposition", decomposition_case, len(DECOMPOSITIONS)),
+    Case("in_units_of", in_units_of_case, 1),
+    Case("in_units_of (str)", in_units_of_str_case, 1),
+    Case("UnitParser()", construction_case, 1),
+    Case("config (snapshot)", lambda: config_case(True), 1),
+    Case("config (no snapshot)", lambda: config_case(False), 1),
+]
+
+
+""" run 'function' repeatedly for about 'duration' seconds per repetition, the best repetition is reported """
+def measure(case, duration, repeat):
+    function = case.setup()
+    function()      # warm up caches
+    timer = timeit.Timer(function)
+    number, elapsed = timer.autorange()
+    number = max(1, int(number * duration / max(elapsed, 1e-9)))
+    best = min(timer.repeat(repeat=repeat, number=number))
+
+    gc.collect()
+    gc.disable()
+    try:
+        start = sys.getallocatedblocks()
+        result = function()
+        blocks = sys.getallocatedblocks() - start
+        del result
+    finally:
+        gc.enable()
+    return Result(case.name, number * case.operations / best, max(blocks, 0) / case.operations)
+
+
+def load_baseline(path):
+    with open(path) as f:
+        data = json.load(f)
+    if data.get("version") != BASELINE_VERSION:
+        raise ValueError(f"Unsupported baseline version in {path}")
+    return data["results"]
+
+
+def save_baseline(path, results):
+    data = {
+        "version": BASELINE_VERSION,
+        "python": sys.version.split()[0],
+        "results": {r.name: {"ops": r.ops, "blocks": r.blocks} for r in results}
+    }
+    with open(path, "w") as f:
+        json.dump(data, f, indent=2)
+
+
+""" returns the names of the cases that are slower or allocate more than the baseline, beyond 'tolerance' """
+def regressions(results, baseline, tolerance):
+    found = []
+    for r in results:
+        base = baseline.get(r.name)
+        if base is None:
+            continue
+        # one block of slack, since cases that keep almost nothing would otherwise flag any single block
+        if r.ops < base["ops"] * (1 - tolerance) or r.blocks > base["blocks"] * (1 + tolerance) + 1:
+            found.append(r.name)
+    return found
+
+
+def main(argv=None):
+    args = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    args.add_argument("--baseline", help="compare against this baseline file")
+    args.add_argument("--save", help="save the results as baseline file")
+    args.add_argument("--tolerance", type=float, default=0.15, help="allowed relative change (default 0.15)")
+    args.add_argument("--duration", type=float, default=0.2, help="seconds per repetition (default 0.2)")
+    args.add_argument("--repeat", type=int, default=5, help="repetitions per case (default 5)")
+    args.add_argument("cases", nargs="*", help="names of the cases to run, all by default")
+    args = args.parse_args(argv)
+
+    cases = [case for case in CASES if not args.cases or case.name in args.cases]
+    baseline = load_baseline(args.baseline) if args.baseline else {}
+
+    unitparser.init()
+    results = []
+    for case in cases:
+        r = measure(case, args.duration, args.repeat)
+        results.append(r)
+        line = f"{r.name:<22} {r.ops:>12.1f} ops/s {r.blocks:>9.1f} blocks/op"
+        base = baseline.get(r.name)
+        if base is not None:
+            line += f"   {r.ops / base['ops'] - 1:>+7.1%} ops/s {r.blocks - base['blocks']:>+7.1f} blocks/op"
+        print(line, flush=True)
+
+    if args.save:
+        save_baseline(args.save, results)
+
+    found = regressions(results, baseline, args.tolerance)
+    if found:
+        print("Regressions:", ", ".join(found))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
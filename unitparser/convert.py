@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+
+""" convert quantities to a common unit, run with python -m unitparser.convert
+
+the input is a CSV file, in which one column holds the quantities, or a file with one quantity per line,
+it is read in chunks, which are converted by a pool of worker processes, so that files of any size can be
+converted in constant memory, values that cannot be converted are written as empty fields """
+
+import io
+import os
+import sys
+import csv
+import time
+import argparse
+import itertools
+import multiprocessing
+from collections import deque
+
+import unitparser
+
+
+__target = None
+
+
+""" build the parser once per worker process """
+def init_worker(target, config):
+    global __target
+    unitparser.init(config)
+    __target = unitparser.parse(target)
+
+
+""" convert a list of strings, returns the converted values as strings and the indices of the failed values """
+def convert_chunk(values):
+    results = []
+    failed = []
+    for i, value in enumerate(values):
+        try:
+            results.append(repr(float(unitparser.in_units_of(value, __target))))
+        except Exception:
+            results.append("")
+            failed.append(i)
+    return results, failed
+
+
+""" the input as chunks of (rows, values), the rows are None for line based input """
+def read_chunks(file, column, delimiter, chunk_size):
+    if column is None:
+        lines = (line.rstrip("\r\n") for line in file)
+        while True:
+            values = list(itertools.islice(lines, chunk_size))
+            if not values:
+                return
+            yield None, values
+
+    reader = csv.reader(file, delimiter=delimiter)
+    while True:
+        rows = list(itertools.islice(reader, chunk_size))
+        if not rows:
+            return
+        yield rows, [row[column] if column < len(row) else "" for row in rows]
+
+
+""" convert the chunks in order, at most 'window' chunks are in flight, to bound the memory use """
+def convert_chunks(chunks, target, config, workers, window):
+    if workers <= 1:
+        init_worker(target, config)
+        for rows, values in chunks:
+            yield rows, values, convert_chunk(values)
+        return
+
+    with multiprocessing.Pool(workers, initializer=init_worker, initargs=(target, config)) as pool:
+        pending = deque()
+        for rows, values in chunks:
+            pending.append((rows, values, pool.apply_async(convert_chunk, (values,))))
+            if len(pending) >= window:
+                rows, values, result = pending.popleft()
+                yield rows, values, result.get()
+        while pending:
+            rows, values, result = pending.popleft()
+            yield rows, values, result.get()
+
+
+""" index of the column given by name or index, None if there is no such column """
+def column_index(header, column):
+    if column.isdigit():
+        return int(column)
+    if header is None or column not in header:
+        return None
+    return header.index(column)
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    arg_parser.add_argument("input", nargs="?", default="-", help="input file, - for stdin (default)")
+    arg_parser.add_argument("-o", "--output", default="-", help="output file, - for stdout (default)")
+    arg_parser.add_argument("-t", "--to", required=True, help="target unit, e.g. \"km/hr\"")
+    arg_parser.add_argument("-c", "--column", help="name or index of the CSV column to convert, "
+                                                   "without it every line is a quantity")
+    arg_parser.add_argument("-d", "--delimiter", default=",", help="CSV delimiter (default ,)")
+    arg_parser.add_argument("--no-header", action="store_true", help="the CSV input has no header row")
+    arg_parser.add_argument("-j", "--workers", type=int, default=os.cpu_count(), help="number of worker processes")
+    arg_parser.add_argument("--chunk-size", type=int, default=10000, help="lines per chunk (default 10000)")
+    arg_parser.add_argument("--config", help="config file of the parser")
+    arg_parser.add_argument("--strict", action="store_true",
+                            help="stop at the first value that cannot be converted")
+    args = arg_parser.parse_args(argv)
+
+    if args.input == "-":
+        source = io.TextIOWrapper(sys.stdin.buffer, newline="")
+    else:
+        source = open(args.input, newline="")
+
+    unitparser.init(args.config)
+    try:
+        unitparser.parse(args.to)   # fail early on an invalid target unit
+    except Exception as e:
+        arg_parser.error(f"invalid target unit {args.to!r}: {e}")
+
+    start = time.perf_counter()
+    num_values = 0
+    num_failed = 0
+    with source:
+        # resolve the column before the output is opened, so that nothing is written on an error
+        column = None
+        header = None
+        if args.column is not None:
+            if not args.no_header:
+                header = next(csv.reader(source, delimiter=args.delimiter), None)
+            column = column_index(header, args.column)
+            if column is None:
+                arg_parser.error(f"unknown column: {args.column}")
+
+        if args.output == "-":
+            target = io.TextIOWrapper(sys.stdout.buffer, newline="")
+        else:
+            target = open(args.output, "w", newline="")
+        with target:
+            writer = None
+            if column is not None:
+                writer = csv.writer(target, delimiter=args.delimiter, lineterminator="\n")
+                if header is not None:
+                    writer.writerow(header)
+
+            chunks = read_chunks(source, column, args.delimiter, args.chunk_size)
+            for rows, values, (results, failed) in convert_chunks(chunks, args.to, args.config, args.workers,
+                                                                    window=2 * max(args.workers, 1)):
+                # in strict mode, the values before the first failure are written before stopping
+                end = failed[0] if failed and args.strict else len(values)
+                if rows is None:
+                    if end > 0:
+                        target.write("\n".join(results[:end]))
+                        target.write("\n")
+                else:
+                    for row, result in zip(rows[:end], results):
+                        if column < len(row):
+                            row[column] = result
+                    writer.writerows(rows[:end])
+                if end < len(values):
+                    raise SystemExit(f"Cannot convert value {num_values + end + 1}: {values[end]!r} to {args.to}")
+                num_values += len(values)
+                num_failed += len(failed)
+
+    elapsed = time.perf_counter() - start
+    print(f"Converted {num_values - num_failed} of {num_values} values in {elapsed:.2f} s "
+          f"({num_values / max(elapsed, 1e-9):.0f} values/s, {num_failed} failed)", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
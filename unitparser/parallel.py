@@ -0,0 +1,151 @@
+""" parse large batches of strings on several cores
+
+the work is split into chunks, that are parsed by a pool of worker processes, where fork is available the
+workers inherit the parser of the calling process, including its lexer, parse table and resolved units,
+otherwise they build it from the cached parse table and config snapshot, results are sent back as arrays of
+numbers and a small table of the distinct units of a chunk, instead of pickled NumberWithUnit objects, e.g.
+
+with unitparser.parallel.Pool(4) as pool:
+    results, errors = pool.parse_many(strings)
+    values, errors = pool.in_units_of(strings, "m/s") """
+
+import os
+import math
+import multiprocessing
+from array import array
+
+import unitparser
+from unitparser.unit.NumberWithUnit import NumberWithUnit, UnitException
+
+
+""" runs in the worker processes, builds the parser unless it was inherited from the parent """
+def init_worker(config):
+    unitparser.init(config)
+
+
+""" returns the numbers, an index into the unit table for every number, the unit table and
+a dictionary of ParseError for the strings that could not be parsed, by their index in the chunk """
+def parse_chunk(strings):
+    results, errors = unitparser._get_parser().parse_many(strings)
+    nums = array("d")
+    unit_ids = array("l")
+    units = {}
+    failed = {}
+    for i, (result, error) in enumerate(zip(results, errors)):
+        if error is not None:
+            failed[i] = error
+            nums.append(math.nan)
+            unit_ids.append(-1)
+        else:
+            nums.append(result.num)
+            unit_ids.append(units.setdefault((result.exponents, result.denominator), len(units)))
+    return nums, unit_ids, list(units), failed
+
+
+""" returns the values of the strings in units of 'unit' and the failures as in parse_chunk """
+def in_units_of_chunk(args):
+    strings, unit = args
+    parser = unitparser._get_parser()
+    reference = parser.parse(unit)
+    results, errors = parser.parse_many(strings)
+    values = array("d")
+    failed = {}
+    for i, (result, error) in enumerate(zip(results, errors)):
+        if error is None:
+            ratio = result / reference
+            if ratio.is_unitless():
+                values.append(ratio.num)
+                continue
+            exception = UnitException(f"Cannot express {str(result)} in units of {str(reference)}")
+            error = parser.parse_error(exception)
+        failed[i] = error
+        values.append(math.nan)
+    return values, failed
+
+
+class Pool:
+    """ 'processes' defaults to the number of cores, 'config' is only used by workers that are not forked,
+    it has to be the config of the parser of this process """
+    def __init__(self, processes=None, config=None):
+        self.processes = processes or os.cpu_count()
+        unitparser.init(config)     # build the parser before forking, so that the workers inherit it
+        if "fork" in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context("fork")
+        else:
+            context = multiprocessing.get_context()
+        self.pool = context.Pool(self.processes, initializer=init_worker, initargs=(config,))
+
+    def chunks(self, strings, chunk_size):
+        if chunk_size is None:
+            chunk_size = max(1, min(10000, len(strings) // (4 * self.processes) + 1))
+        return [strings[i:i + chunk_size] for i in range(0, len(strings), chunk_size)]
+
+    """ same as unitparser.parse_many, the distinct strings are parsed by the worker processes,
+    the numbers of the results are always floats """
+    def parse_many(self, strings, chunk_size=None):
+        strings = list(strings)
+        distinct = list(dict.fromkeys(strings))
+        cfg = unitparser._get_parser().cfg
+        results = []
+        errors = []
+        for nums, unit_ids, units, failed in self.pool.map(parse_chunk, self.chunks(distinct, chunk_size)):
+            offset = len(results)
+            for num, unit_id in zip(nums, unit_ids):
+                if unit_id < 0:
+                    results.append(None)
+                else:
+                    exponents, denominator = units[unit_id]
+                    results.append(NumberWithUnit.from_exponents(num, exponents, denominator, cfg.base_units))
+            errors.extend([None] * len(nums))
+            for i, error in failed.items():
+                errors[offset + i] = error
+        return self.expand(strings, distinct, results, errors)
+
+    """ values of the strings in units of 'unit', returns a list of floats and a list of ParseError,
+    aligned with the input, for the strings that could not be converted the value is None """
+    def in_units_of(self, strings, unit, chunk_size=None):
+        strings = list(strings)
+        distinct = list(dict.fromkeys(strings))
+        values = []
+        errors = []
+        chunks = [(chunk, unit) for chunk in self.chunks(distinct, chunk_size)]
+        for chunk_values, failed in self.pool.map(in_units_of_chunk, chunks):
+            offset = len(values)
+            values.extend(chunk_values)
+            errors.extend([None] * len(chunk_values))
+            for i, error in failed.items():
+                values[offset + i] = None
+                errors[offset + i] = error
+        return self.expand(strings, distinct, values, errors)
+
+    """ map the results of the distinct strings back to all strings """
+    @staticmethod
+    def expand(strings, distinct, results, errors):
+        if len(distinct) == len(strings):
+            return results, errors
+        index = {data: i for i, data in enumerate(distinct)}
+        indices = [index[data] for data in strings]
+        return [results[i] for i in indices], [errors[i] for i in indices]
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.pool.terminate()
+        self.pool.join()
+
+
+""" parse many strings with a temporary pool, see Pool.parse_many """
+def parse_many(strings, processes=None, chunk_size=None):
+    with Pool(processes) as pool:
+        return pool.parse_many(strings, chunk_size)
+
+
+""" convert many strings with a temporary pool, see Pool.in_units_of """
+def in_units_of(strings, unit, processes=None, chunk_size=None):
+    with Pool(processes) as pool:
+        return pool.in_units_of(strings, unit, chunk_size)
@@ -2,8 +2,17 @@ import re
 from collections import namedtuple
 
 
+""" 'data' and 'pos' locate the error in the input, the message including them is only built when needed """
 class LexerException(Exception):
-    pass
+    def __init__(self, message, data=None, pos=None):
+        super().__init__(message)
+        self.data = data
+        self.pos = pos
+
+    def __str__(self):
+        if self.data is None:
+            return super().__str__()
+        return "%s:\n  %s\n  %s^" % (self.args[0], self.data, " " * self.pos)
 
 
 LexerToken = namedtuple("LexerToken", ["name", "pattern", "value", "ignore"], defaults=(lambda x: None, False))
@@ -13,35 +22,67 @@ Token = namedtuple("Token", ["name", "pos", "value"], defaults=(None,))
 LexerMatch = namedtuple("LexerMatch", ["type", "length", "match"])
 
 
+""" a lexer is not modified after construction, so that it can be shared between threads,
+'replace_token' returns a new lexer instead """
 class Lexer:
     def __init__(self, tokens):
-        self.tokens = []
-        for token in tokens:
-            self.tokens.append(TokenType(token.name, re.compile(token.pattern), token.value, token.ignore))
+        self.compile([TokenType(token.name, re.compile(token.pattern), token.value, token.ignore) for token in tokens])
+
+    """ returns a copy of the lexer, with the pattern of an existing token type replaced """
+    def replace_token(self, name, pattern):
+        token_types = list(self.tokens)
+        for i, token in enumerate(token_types):
+            if token.name == name:
+                token_types[i] = TokenType(name, re.compile(pattern), token.value, token.ignore)
+                break
+        else:
+            raise LexerException(f"Unknown token type: {name}")
+        lexer = Lexer.__new__(Lexer)
+        lexer.compile(token_types)
+        return lexer
+
+    """ combine all token patterns into a single regex,
+    every pattern is wrapped in an optional lookahead with its own group, so that one match
+    at a given position reports the end of every token that matches there """
+    def compile(self, token_types):
+        self.tokens = tuple(token_types)
         self.eof = TokenType("eof", None, None, None)
+        parts = []
+        for i, token in enumerate(self.tokens):
+            parts.append(f"(?:(?=(?P<_t{i}>{token.regex.pattern})))?")
+        self.master = re.compile("".join(parts))
+        self.groups = tuple((self.master.groupindex[f"_t{i}"], token) for i, token in enumerate(self.tokens))
 
-    def next(self, data, index):
+    """ find the longest token starting at 'index', returns the token type and end position,
+    if several tokens have the same length, the last one is accepted """
+    def scan(self, data, index):
+        regs = self.master.match(data, index).regs
         best = None
-        for token in self.tokens:
-            match = token.regex.match(data, pos=index)
-            if match is None:
-                continue
-            length = match.end() - match.start()
-            if best is None or best.length <= length:   # if length equal, accept last match
-                best = LexerMatch(token, length, match)
+        best_end = index
+        for group, token in self.groups:
+            end = regs[group][1]
+            if end >= best_end:
+                best = token
+                best_end = end
         if best is None:
-            raise LexerException("Lexer error:\n  %s\n  %s^" % (data, " " * index))
-        return best
+            raise LexerException("Lexer error", data, index)
+        return best, best_end
+
+    def next(self, data, index):
+        token, end = self.scan(data, index)
+        return LexerMatch(token, end - index, token.regex.match(data, pos=index))
 
     def lex(self, data):
+        return list(self.lex_stream(data))
+
+    """ generate tokens lazily, the input is only scanned as far as the tokens are consumed """
+    def lex_stream(self, data):
         index = 0
-        tokens = []
         while True:
-            match = self.next(data, index)
-            if not match.type.ignore:
-                value = match.type.value(match.match.group(0))
-                tokens.append(Token(match.type.name, match.match.start(), value))
-            index = match.match.end()
+            token, end = self.scan(data, index)
+            if not token.ignore:
+                yield Token(token.name, index, token.value(data[index:end]))
+            index = end
             if index == len(data):
-                tokens.append(Token(self.eof.name, index))
-                return tokens
+                yield Token(self.eof.name, index)
+                return
@@ -1,15 +1,72 @@
+import os
 import sys
-from collections import namedtuple
+import json
+import hashlib
+import tempfile
+from array import array
+from collections import namedtuple, deque
 from unitparser.parser import Lexer
 
 
+""" same as LexerException, the input is only included in the message if 'data' is given """
 class ParserException(Exception):
-    pass
+    def __init__(self, message, data=None, pos=None):
+        super().__init__(message)
+        self.data = data
+        self.pos = pos
+
+    def __str__(self):
+        if self.data is None:
+            return super().__str__()
+        return "%s:\n  %s\n  %s^" % (self.args[0], self.data, " " * self.pos)
 
 
 GrammarRule = namedtuple("GrammarRule", ["target", "expansion", "value", "priority"], defaults=(lambda x: x, -1))
 StackItem = namedtuple("StackItem", ["item", "state"])
 
+TABLE_CACHE_VERSION = 2
+
+
+""" directory for cached parse tables, can be overridden with UNITPARSER_CACHE_DIR """
+def cache_directory():
+    path = os.environ.get("UNITPARSER_CACHE_DIR")
+    if path is None:
+        base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+        path = os.path.join(base, "unitparser")
+    return path
+
+
+""" write 'data' as JSON to a file in the cache, through a temporary file of its own, so that concurrent readers
+never see a partial file and concurrent writers do not mix their output, failures are ignored since the cache is
+optional """
+def write_cache_file(path, data):
+    tmp_path = None
+    try:
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(suffix=".tmp", prefix=os.path.basename(path) + ".", dir=directory)
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+    except (OSError, TypeError, ValueError):
+        if tmp_path is not None:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+
+""" wraps an iterable of tokens, the current token can be accessed and consumed in constant time """
+class TokenStream:
+    def __init__(self, tokens):
+        self.tokens = iter(tokens)
+        self.current = next(self.tokens)
+
+    def advance(self):
+        token = self.current
+        self.current = next(self.tokens, None)
+        return token
+
 
 class Symbol:
     def __init__(self, name):
@@ -46,27 +103,6 @@ class Nonterminal(Symbol):
         if isinstance(production.expansion[0], Terminal):
             self.first.add(production.expansion[0])
 
-    def update_nullable(self):
-        if self.nullable:
-            return False
-        for prod in self.productions:
-            for symbol in prod.expansion:
-                if not symbol.nullable:
-                    break
-            else:
-                self.nullable = True
-                return True
-        return False
-
-    def update_first(self):
-        oldlen = len(self.first)
-        for prod in self.productions:
-            for symbol in prod.expansion:
-                self.first.update(symbol.first)
-                if not symbol.nullable:
-                    break
-        return len(self.first) != oldlen
-
     def __str__(self):
         return f"NT({self.name})"
 
@@ -80,7 +116,7 @@ class Production:
         self.id = len(parser.productions)
         self.priority = rule.priority
 
-    def apply(self, rhs):
+    def apply(self, rhs, value=None):
         args = []
         for arg in rhs:
             if isinstance(arg, Lexer.Token):
@@ -88,7 +124,11 @@ class Production:
                     args.append(arg.value)
             else:
                 args.append(arg)
-        return self.value(*args)
+        if value is None:
+            value = self.value
+            if value is None:
+                raise ValueError(f"Production {self.id} has no value, the parser has to be called with 'values'")
+        return value(*args)
 
     def __repr__(self):
         return f"P({self.id})"
@@ -149,16 +189,14 @@ class NFA:
                         state.transitions.add(NFATransition("eps", target))
 
     def closure(self, states):
-        assert isinstance(states, tuple)
-        closed = list(states)
-        i = 0
-        while i < len(closed):
-            if closed[i] not in closed[:i]:
-                for trans in self.states[closed[i]].transitions:    # add targets of all epsilon transitions
-                    if trans.symbol == "eps":
-                        closed.append(trans.target)
-            i += 1
-        return tuple(sorted(list(set(closed))))
+        closed = set(states)
+        pending = list(closed)
+        while len(pending) > 0:
+            for trans in self.states[pending.pop()].transitions:    # add targets of all epsilon transitions
+                if trans.symbol == "eps" and trans.target not in closed:
+                    closed.add(trans.target)
+                    pending.append(trans.target)
+        return tuple(sorted(closed))
 
     def print(self):
         print(f"NFA: start={self.start_state}")
@@ -167,9 +205,9 @@ class NFA:
 
 
 class DFAState:
-    def __init__(self, nfa, dfa, start_state):
+    def __init__(self, nfa, dfa, nfa_states):
         self.id = len(dfa.states)
-        self.nfa_states = nfa.closure(start_state)
+        self.nfa_states = nfa_states
 
         self.transitions = {}
         self.accepting = set()
@@ -181,18 +219,11 @@ class DFAState:
                     continue
                 nd_trans.setdefault(trans.symbol, set()).add(trans.target)
         for sym, transitions in nd_trans.items():
-            target_states = nfa.closure(tuple(transitions))
+            target_states = nfa.closure(transitions)
             self.transitions[sym] = target_states
-            for state in dfa.states.values():
-                if state.nfa_states == target_states:
-                    break
-            else:
-                for state in dfa.pending_states:
-                    if state == target_states:
-                        break
-                else:
-                    if target_states != self:
-                        dfa.pending_states.append(target_states)
+            if target_states not in dfa.known_states:
+                dfa.known_states.add(target_states)
+                dfa.pending_states.append(target_states)
         for state in self.nfa_states:
             for acc in nfa.states[state].accepting:
                 self.accepting.add(acc)
@@ -208,11 +239,12 @@ class DFAState:
 class DFA:
     def __init__(self, nfa):
         self.states = {}
-        self.pending_states = []
+        start_states = nfa.closure((nfa.start_state,))
+        self.known_states = {start_states}     # closures that are either built or pending
+        self.pending_states = deque([start_states])
 
-        DFAState(nfa, self, (nfa.start_state,))
         while len(self.pending_states) > 0:
-            DFAState(nfa, self, self.pending_states.pop(0))
+            DFAState(nfa, self, self.pending_states.popleft())
 
         inv_states = {state.nfa_states: state.id for state in self.states.values()}
 
@@ -306,10 +338,53 @@ class ParseTable:
             return False
         return True
 
+    """ serializable representation, actions are stored in the same format as they are printed """
+    def to_dict(self):
+        return {
+            "symbols": [sym.name for sym in self.table_sym],
+            "states": [[str(self.data[state][sym]) if self.data[state][sym] is not None else None
+                        for sym in self.table_sym] for state in sorted(self.data.keys())]
+        }
+
+    """ reconstruct a table from 'to_dict', without building the automaton,
+    raises ValueError if the data does not fit the grammar of 'parser', e.g. if the file is stale or corrupted """
+    @classmethod
+    def from_dict(cls, data, parser):
+        table = cls.__new__(cls)
+        table.table_sym = [parser.symbols[name] for name in data["symbols"]]
+        expected = [name for name in parser.symbols if name not in ("START", "START'")]
+        if sorted(data["symbols"]) != sorted(expected):
+            raise ValueError("Symbols of the parse table do not match the grammar")
+        num_states = len(data["states"])
+        table.data = {}
+        for state_id, row in enumerate(data["states"]):
+            if len(row) != len(table.table_sym):
+                raise ValueError(f"Invalid row length in state {state_id}")
+            table.data[state_id] = {}
+            for sym, action in zip(table.table_sym, row):
+                table.data[state_id][sym] = cls.parse_action(action, sym, num_states, len(parser.productions))
+        return table
+
+    """ action of 'to_dict', the target has to be a valid state or production for the kind of action and symbol """
+    @staticmethod
+    def parse_action(action, sym, num_states, num_productions):
+        if action is None:
+            return None
+        if action == "A":
+            return ActionAccept()
+        kind, target = action[0], int(action[1:])
+        if kind == "S" and isinstance(sym, Terminal) and 0 <= target < num_states:
+            return ActionShift(target)
+        if kind == "G" and isinstance(sym, Nonterminal) and 0 <= target < num_states:
+            return ActionGoto(target)
+        if kind == "R" and isinstance(sym, Terminal) and 0 < target < num_productions:
+            return ActionReduce(target)
+        raise ValueError(f"Invalid action {action} for symbol {sym.name}")
+
     def print(self, parser):
         print("SLR table:")
         print(" " * 9, "\t".join([x.name for x in self.table_sym]).expandtabs(10))
-        for i in range(len(parser.dfa.states)):
+        for i in range(len(self.data)):
             row = str(i)
             for sym in self.table_sym:
                 if self.data[i][sym] is None:
@@ -319,8 +394,51 @@ class ParseTable:
             print(row.expandtabs(10))
 
 
+""" dense version of a ParseTable, used by Parser.parse_compact,
+symbols are replaced by integer ids and every action is packed into one integer of a flat array
+at index state * num_symbols + symbol: the lowest two bits encode the kind of action,
+the remaining bits the target state or production, 0 is an error and ACCEPT is 4 """
+class CompactParseTable:
+    SHIFT = 1
+    REDUCE = 2
+    GOTO = 3
+    ACCEPT = 4
+
+    def __init__(self, table, parser):
+        self.symbol_ids = {sym.name: i for i, sym in enumerate(table.table_sym)}
+        self.num_symbols = len(table.table_sym)
+        self.actions = array("q", [0]) * (len(table.data) * self.num_symbols)
+        for state_id, row in table.data.items():
+            for i, sym in enumerate(table.table_sym):
+                self.actions[state_id * self.num_symbols + i] = self.encode(row[sym])
+
+        productions = parser.productions
+        self.prod_length = array("q", [len(prod.expansion) for prod in productions])
+        self.prod_target = array("q", [self.symbol_ids.get(prod.target.name, -1) for prod in productions])
+        self.prod_value = [prod.value for prod in productions]
+        self.has_values = all(value is not None for value in self.prod_value)
+        # positions of terminals, their value is dropped if it is None, see Production.apply
+        self.prod_terminals = [tuple(isinstance(sym, Terminal) for sym in prod.expansion)
+                               if any(isinstance(sym, Terminal) for sym in prod.expansion) else None
+                               for prod in productions]
+
+    @classmethod
+    def encode(cls, action):
+        if action is None:
+            return 0
+        if isinstance(action, ActionShift):
+            return action.target << 2 | cls.SHIFT
+        if isinstance(action, ActionReduce):
+            return action.prod << 2 | cls.REDUCE
+        if isinstance(action, ActionGoto):
+            return action.target << 2 | cls.GOTO
+        if isinstance(action, ActionAccept):
+            return cls.ACCEPT
+        raise Exception("Parse error: %s" % action)
+
+
 class Parser:
-    def __init__(self, grammar_rules, lexer_tokens):
+    def __init__(self, grammar_rules, lexer_tokens, cache=True):
         list_of_nonterminals = [rule.target for rule in grammar_rules] + ["START", "START'"]
         self.nonterminals = {name: Nonterminal(name) for name in list_of_nonterminals}
         self.terminals = {token.name: Terminal(token.name) for token in lexer_tokens}
@@ -337,37 +455,121 @@ class Parser:
             Production(GrammarRule("START'", "START eof", None), self)
         ]
 
-        changed = True
-        while changed:
-            changed = False
-            for nonterm in self.nonterminals.values():
-                changed |= nonterm.update_nullable()
-        changed = True
-        while changed:
-            changed = False
-            for nonterm in self.nonterminals.values():
-                changed |= nonterm.update_first()
-
-        changed = True
-        while changed:
-            changed = False
-            for prod in self.extended_productions:
-                for i, symbol in enumerate(prod.expansion):
-                    if isinstance(symbol, Terminal):
-                        continue
-                    oldlen = len(symbol.follow)
-                    if len(prod.expansion) > i + 1:
-                        symbol.follow.update(prod.expansion[i + 1].first)
-                    if prod.target != symbol and all([x.nullable for x in prod.expansion[i + 1:]]):
-                        symbol.follow.update(prod.target.follow)
-                    changed |= len(symbol.follow) != oldlen
+        self.nfa = None
+        self.dfa = None
+        self.table = None
+        self.cache_path = None
+        if cache:
+            self.cache_path = os.path.join(cache_directory(), f"table-{self.grammar_hash(grammar_rules, lexer_tokens)}.json")
+            self.table = self.load_table()
+        if self.table is None:
+            self.build()
+            if cache:
+                self.save_table()
+        self.compact_table = CompactParseTable(self.table, self)
+
+    """ hash of everything the parse table depends on, the values of the rules are not included """
+    @staticmethod
+    def grammar_hash(grammar_rules, lexer_tokens):
+        key = [
+            TABLE_CACHE_VERSION,
+            [[rule.target, rule.expansion.split(), rule.priority] for rule in grammar_rules],
+            [token.name for token in lexer_tokens]
+        ]
+        return hashlib.sha256(json.dumps(key).encode()).hexdigest()[:32]
+
+    """ compute first and follow sets, the automaton and the parse table """
+    def build(self):
+        self.compute_nullable()
+        self.compute_first()
+        self.compute_follow()
 
         self.nfa = NFA(self)
         self.dfa = DFA(self.nfa)
 
         self.table = ParseTable(self.dfa, self)
 
+    """ propagate nullability with a worklist, a production is nullable once its remaining count reaches zero """
+    def compute_nullable(self):
+        remaining = {}
+        users = {}
+        pending = []
+        for prod in self.extended_productions:
+            remaining[prod] = len(prod.expansion)
+            for symbol in prod.expansion:
+                users.setdefault(symbol, []).append(prod)
+            if remaining[prod] == 0:
+                pending.append(prod.target)
+        while len(pending) > 0:
+            symbol = pending.pop()
+            if symbol.nullable:
+                continue
+            symbol.nullable = True
+            for prod in users.get(symbol, []):
+                remaining[prod] -= 1    # symbols appearing twice are counted twice
+                if remaining[prod] == 0:
+                    pending.append(prod.target)
+
+    """ first(A) contains first(X) for every leading symbol X of A's productions, up to the first non nullable one,
+    the sets are propagated along these edges with a worklist """
+    def compute_first(self):
+        dependents = {}
+        for nonterm in self.nonterminals.values():
+            for prod in nonterm.productions:
+                for symbol in prod.expansion:
+                    if isinstance(symbol, Terminal):
+                        nonterm.first.add(symbol)
+                    elif symbol is not nonterm:
+                        dependents.setdefault(symbol, set()).add(nonterm)
+                    if not symbol.nullable:
+                        break
+        self.propagate(dependents, "first")
+
+    """ follow(X) contains first of the symbols after X and, if they are all nullable, follow of the target,
+    the latter are propagated with a worklist """
+    def compute_follow(self):
+        dependents = {}
+        for prod in self.extended_productions:
+            for i, symbol in enumerate(prod.expansion):
+                if isinstance(symbol, Terminal):
+                    continue
+                for next_symbol in prod.expansion[i + 1:]:
+                    symbol.follow.update(next_symbol.first)
+                    if not next_symbol.nullable:
+                        break
+                else:
+                    if prod.target is not symbol:
+                        dependents.setdefault(prod.target, set()).add(symbol)
+        self.propagate(dependents, "follow")
+
+    """ make attribute 'attr' of every symbol a superset of the attribute of all symbols it depends on """
+    @staticmethod
+    def propagate(dependents, attr):
+        pending = list(dependents.keys())
+        while len(pending) > 0:
+            source = pending.pop()
+            values = getattr(source, attr)
+            for target in dependents.get(source, ()):
+                target_values = getattr(target, attr)
+                if not values <= target_values:
+                    target_values |= values
+                    pending.append(target)
+
+    """ load the parse table from the cache, returns None if it is missing or unusable """
+    def load_table(self):
+        try:
+            with open(self.cache_path) as f:
+                return ParseTable.from_dict(json.load(f), self)
+        except (OSError, ValueError, KeyError, IndexError, TypeError):
+            return None
+
+    """ write the parse table to the cache, see write_cache_file """
+    def save_table(self):
+        write_cache_file(self.cache_path, self.table.to_dict())
+
     def print(self):
+        if self.dfa is None:    # table was loaded from the cache
+            self.build()
         print("Terminals:", self.terminals.values())
         print("Nonterminals:", self.nonterminals.values())
         print("Productions:\n ", "\n  ".join(map(str, self.productions)))
@@ -384,16 +586,16 @@ class Parser:
         print()
         self.table.print(self)
 
-    def parse_single(self, token_list, stack, raw_data=None):
+    def parse_single(self, tokens, stack, raw_data=None, values=None):
         state = stack[-1].state
-        action = self.table.data[state][self.symbols[token_list[0].name]]
+        action = self.table.data[state][self.symbols[tokens.current.name]]
         if isinstance(action, ActionShift):
-            stack.append(StackItem(token_list.pop(0), action.target))
+            stack.append(StackItem(tokens.advance(), action.target))
         elif isinstance(action, ActionReduce):
             prod = self.productions[action.prod]
             num_symbols = len(prod.expansion)
             args = [x for x, y in stack[len(stack) - num_symbols:]]
-            item = prod.apply(args)
+            item = prod.apply(args, values[prod.id] if values is not None else None)
             del stack[len(stack) - num_symbols:]    # use del, to avoid parameter assignment
             action = self.table.data[stack[-1].state][prod.target]
             assert isinstance(action, ActionGoto), "Invalid parse table"
@@ -401,19 +603,74 @@ class Parser:
         elif isinstance(action, ActionAccept):
             return True
         elif action is None:
-            if raw_data is None:
-                raise ParserException("Syntax error")
-            raise ParserException("Syntax error:\n  %s\n  %s^" % (raw_data, " " * token_list[0].pos))
+            raise ParserException("Syntax error", raw_data, tokens.current.pos)
         else:
             raise Exception("Parse error: %s" % action)
         return False
 
-    def parse(self, token_list, raw_data=None, debug=False):
+    """ parse a list or any other iterable of tokens, e.g. a generator returned by Lexer.lex_stream,
+    'values' can replace the value functions of the productions, indexed by production id """
+    def parse(self, token_list, raw_data=None, debug=False, values=None):
         stack = [StackItem(None, 0)]
-        token_list = token_list.copy()
+        tokens = TokenStream(token_list)
 
-        while not self.parse_single(token_list, stack, raw_data):
+        while not self.parse_single(tokens, stack, raw_data, values):
             if debug:
-                print(stack, token_list)
+                print(stack, tokens.current)
 
         return stack[1].item
+
+    """ same as 'parse', but driven by the compact table, without allocating a stack item per step,
+    'values' can replace the value functions of the productions, indexed by production id """
+    def parse_compact(self, token_list, raw_data=None, values=None):
+        table = self.compact_table
+        actions = table.actions
+        num_symbols = table.num_symbols
+        symbol_ids = table.symbol_ids
+        prod_length = table.prod_length
+        prod_target = table.prod_target
+        if values is None and not table.has_values:
+            raise ValueError("The productions have no values, the parser has to be called with 'values'")
+        prod_value = table.prod_value if values is None else values
+        prod_terminals = table.prod_terminals
+
+        states = [0]
+        items = [None]
+        starts = [0]    # position of the first token of every item
+        tokens = iter(token_list)
+        token = next(tokens)
+        symbol = symbol_ids[token.name]
+
+        while True:
+            code = actions[states[-1] * num_symbols + symbol]
+            kind = code & 3
+            if kind == CompactParseTable.SHIFT:
+                states.append(code >> 2)
+                items.append(token.value)
+                starts.append(token.pos)
+                token = next(tokens)
+                symbol = symbol_ids[token.name]
+            elif kind == CompactParseTable.REDUCE:
+                prod = code >> 2
+                length = prod_length[prod]
+                args = items[-length:]
+                terminals = prod_terminals[prod]
+                if terminals is not None:
+                    args = [arg for arg, terminal in zip(args, terminals) if arg is not None or not terminal]
+                start = starts[-length]
+                try:
+                    item = prod_value[prod](*args)
+                except Exception as e:
+                    if getattr(e, "pos", False) is None:    # exception supports a position, but has none yet
+                        e.pos = start
+                    raise
+                del states[-length:]
+                del items[-length:]
+                del starts[-length:]
+                states.append(actions[states[-1] * num_symbols + prod_target[prod]] >> 2)
+                items.append(item)
+                starts.append(start)
+            elif code == CompactParseTable.ACCEPT:
+                return items[1]
+            else:
+                raise ParserException("Syntax error", raw_data, token.pos)
@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+
+""" conversion service, run with python -m unitparser.server
+
+clients send newline-delimited JSON requests over a Unix socket, a TCP socket or HTTP on localhost, e.g.
+  {"id": 1, "op": "parse", "expr": "3 km/hr"}
+  {"id": 2, "op": "in_units_of", "expr": "3 km/hr", "unit": "m/s"}
+  {"id": 3, "op": "stats"}
+and receive one JSON response per line, in the order of the requests of their connection, e.g.
+  {"id": 1, "value": 0.833333333333, "unit": "m s^-1"}
+  {"id": 2, "value": 0.833333333333}
+  {"id": 3, "stats": {"requests": 2, ...}}
+errors are reported as e.g. {"id": 4, "error": "unit", "message": "Unknown unit: x", "pos": 1}
+
+requests of all clients are collected in micro-batches and evaluated by a single parser in a worker thread,
+the parser shares a cache of results between all clients, when the queue of pending requests is full,
+connections stop being read until the batches are processed """
+
+import sys
+import json
+import math
+import time
+import asyncio
+import argparse
+from collections import deque
+
+import unitparser
+from unitparser.unit.UnitParser import UnitParser
+
+
+""" number of requests, batches, errors and a window of recent latencies,
+the counters are only modified in the event loop thread """
+class ServerStats:
+    def __init__(self, window=10000):
+        self.start = time.perf_counter()
+        self.requests = 0
+        self.batches = 0
+        self.errors = 0
+        self.rejected = 0
+        self.latencies = deque(maxlen=window)
+
+    def add(self, latency, error):
+        self.requests += 1
+        self.errors += error
+        self.latencies.append(latency)
+
+    def snapshot(self):
+        latencies = sorted(self.latencies)
+
+        def percentile(p):
+            if not latencies:
+                return None
+            return latencies[min(len(latencies) - 1, int(p * len(latencies)))]
+        elapsed = time.perf_counter() - self.start
+        return {
+            "requests": self.requests,
+            "batches": self.batches,
+            "errors": self.errors,
+            "rejected": self.rejected,
+            "mean batch size": self.requests / self.batches if self.batches else None,
+            "requests/s": self.requests / elapsed,
+            "latency p50": percentile(0.5),
+            "latency p99": percentile(0.99),
+            "latency max": latencies[-1] if latencies else None,
+        }
+
+
+class Server:
+    def __init__(self, config=None, cache_size=65536, batch_size=256, batch_delay=0.0005, queue_size=4096):
+        self.parser = UnitParser(config)
+        self.parser.set_result_cache(cache_size)
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self.queue = None
+        self.queue_size = queue_size
+        self.stats = ServerStats()
+        self.batcher = None
+
+    async def start(self):
+        self.queue = asyncio.Queue(self.queue_size)
+        self.batcher = asyncio.create_task(self.run_batches())
+
+    async def stop(self):
+        if self.batcher is not None:
+            self.batcher.cancel()
+
+    """ handle a request, the returned future holds the response, all requests go through the queue, also invalid
+    ones and "stats", so that they are counted and answered in order """
+    async def submit(self, request):
+        future = asyncio.get_running_loop().create_future()
+        response = None
+        if not isinstance(request, dict):
+            response = {"error": "request", "message": "Request has to be a JSON object"}
+        else:
+            for field in ("op", "expr", "unit"):
+                if field in request and not isinstance(request[field], str):
+                    response = {"id": request.get("id"), "error": "request",
+                                "message": f"Field '{field}' has to be a string"}
+                    break
+        await self.queue.put((request, future, time.perf_counter(), response))     # waits while the queue is full
+        return future
+
+    """ collect requests until 'batch_size' are available or 'batch_delay' has passed, then evaluate them,
+    "stats" is answered after the requests before it are counted """
+    async def run_batches(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.batch_delay
+            while len(batch) < self.batch_size:
+                if self.queue.empty():
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        break
+                    await asyncio.sleep(min(remaining, self.batch_delay))
+                    if self.queue.empty():
+                        break
+                batch.append(self.queue.get_nowait())
+            requests = [request for request, _, _, response in batch
+                        if response is None and request.get("op") != "stats"]
+            responses = []
+            if requests:
+                try:
+                    responses = await loop.run_in_executor(None, self.evaluate, requests)
+                except Exception as e:
+                    error = {"error": "internal", "message": str(e)}
+                    responses = [{"id": request["id"], **error} if "id" in request else error
+                                 for request in requests]
+            self.stats.batches += 1
+            now = time.perf_counter()
+            responses = iter(responses)
+            for request, future, start, response in batch:
+                if response is None:
+                    if request.get("op") == "stats":
+                        response = {"id": request.get("id"), "stats": self.stats.snapshot()}
+                    else:
+                        response = next(responses)
+                self.stats.add(now - start, "error" in response)
+                if not future.cancelled():
+                    future.set_result(response)
+
+    """ evaluate a batch of requests, identical requests are only evaluated once """
+    def evaluate(self, requests):
+        done = {}
+        responses = []
+        for request in requests:
+            key = (request.get("op"), request.get("expr"), request.get("unit"))
+            response = done.get(key)
+            if response is None:
+                response = done[key] = self.evaluate_single(*key)
+            if "id" in request:
+                response = {"id": request["id"], **response}
+            responses.append(response)
+        return responses
+
+    def evaluate_single(self, op, expr, unit):
+        try:
+            if not isinstance(expr, str):
+                return {"error": "request", "message": "Missing expression"}
+            if op == "parse":
+                value = self.parser.parse(expr)
+                return self.value_response(value.num, unit=value.unit_str().strip())
+            if op == "in_units_of":
+                if not isinstance(unit, str):
+                    return {"error": "request", "message": "Missing unit"}
+                value = self.parser.parse(expr) / self.parser.parse(unit)
+                if not value.is_unitless():
+                    raise unitparser.UnitException(f"Cannot express {expr} in units of {unit}")
+                return self.value_response(value.num)
+            return {"error": "request", "message": f"Unknown operation: {op}"}
+        except Exception as e:
+            error = self.parser.parse_error(e)
+            return {"error": error.kind, "message": str(e.args[0]) if e.args else str(e), "pos": error.pos}
+
+    """ JSON has no infinite or NaN numbers, such results are reported as errors """
+    @staticmethod
+    def value_response(num, **fields):
+        value = float(num)
+        if not math.isfinite(value):
+            return {"error": "error", "message": f"Result is not a finite number: {value}"}
+        return {"value": value, **fields}
+
+    """ newline-delimited JSON over a Unix or TCP socket, responses are written in the order of the requests """
+    async def handle_stream(self, reader, writer):
+        pending = asyncio.Queue(self.batch_size)
+
+        async def respond():
+            while True:
+                future = await pending.get()
+                if future is None:
+                    break
+                writer.write(self.encode(await future))
+                if pending.empty():
+                    await writer.drain()
+        responder = asyncio.create_task(respond())
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if line.strip():
+                    await pending.put(await self.submit(self.decode(line)))
+            await pending.put(None)
+            await responder
+        except (ConnectionError, asyncio.IncompleteReadError):
+            responder.cancel()
+        finally:
+            writer.close()
+
+    """ HTTP on localhost, the body of a POST request holds newline-delimited JSON requests,
+    the response holds the responses in the same format, GET /stats returns the counters """
+    async def handle_http(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+                if method == "GET" and path == "/stats":
+                    status, content = "200 OK", self.encode(self.stats.snapshot())
+                elif method == "POST":
+                    futures = [await self.submit(self.decode(line)) for line in body.splitlines() if line.strip()]
+                    status, content = "200 OK", b"".join([self.encode(await future) for future in futures])
+                else:
+                    status, content = "404 Not Found", b""
+                writer.write(f"HTTP/1.1 {status}\r\nContent-Type: application/x-ndjson\r\n"
+                             f"Content-Length: {len(content)}\r\n\r\n".encode() + content)
+                await writer.drain()
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (ConnectionError, ValueError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    """ a response as a line of strict JSON """
+    @staticmethod
+    def encode(response):
+        return json.dumps(response, allow_nan=False).encode() + b"\n"
+
+    """ a request, NaN, Infinity and numbers too large for a float are rejected, since they could not be sent back
+    in the id of the response """
+    def decode(self, line):
+        try:
+            return json.loads(line, parse_constant=self.reject_constant, parse_float=self.finite_float)
+        except ValueError:
+            self.stats.rejected += 1
+            return None
+
+    @staticmethod
+    def reject_constant(name):
+        raise ValueError(f"Invalid JSON constant: {name}")
+
+    @staticmethod
+    def finite_float(data):
+        value = float(data)
+        if not math.isfinite(value):
+            raise ValueError(f"Number out of range: {data}")
+        return value
+
+
+async def serve(args):
+    server = Server(args.config, args.cache_size, args.batch_size, args.batch_delay / 1000, args.queue_size)
+    await server.start()
+    if args.socket:
+        listener = await asyncio.start_unix_server(server.handle_stream, path=args.socket)
+    elif args.http:
+        listener = await asyncio.start_server(server.handle_http, "127.0.0.1", args.port)
+    else:
+        listener = await asyncio.start_server(server.handle_stream, "127.0.0.1", args.port)
+    print("Listening on", ", ".join(str(s.getsockname()) for s in listener.sockets), file=sys.stderr)
+    async with listener:
+        await listener.serve_forever()
+
+
+def main(argv=None):
+    args = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    args.add_argument("--socket", help="path of a Unix socket to listen on")
+    args.add_argument("--port", type=int, default=8765, help="TCP port on localhost (default 8765)")
+    args.add_argument("--http", action="store_true", help="speak HTTP on the TCP port")
+    args.add_argument("--config", help="config file of the parser")
+    args.add_argument("--cache-size", type=int, default=65536, help="number of cached results (default 65536)")
+    args.add_argument("--batch-size", type=int, default=256, help="maximum requests per batch (default 256)")
+    args.add_argument("--batch-delay", type=float, default=0.5,
+                      help="milliseconds to wait for more requests of a batch (default 0.5)")
+    args.add_argument("--queue-size", type=int, default=4096,
+                      help="pending requests, before connections stop being read (default 4096)")
+    args = args.parse_args(argv)
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,163 @@
+import math
+import operator
+from fractions import Fraction
+import numpy as np
+from unitparser.unit.NumberWithUnit import NumberWithUnit, UnitException
+
+
+""" numpy versions of the functions registered by UnitParser.load_default_functions """
+UFUNCS = {
+    math.sin: np.sin, math.cos: np.cos, math.tan: np.tan,
+    math.asin: np.arcsin, math.acos: np.arccos, math.atan: np.arctan,
+    math.sinh: np.sinh, math.cosh: np.cosh, math.tanh: np.tanh,
+    math.asinh: np.arcsinh, math.acosh: np.arccosh, math.atanh: np.arctanh,
+    math.exp: np.exp, math.log2: np.log2, math.log10: np.log10,
+    math.log: lambda x, base=math.e: np.log(x) / np.log(base),
+}
+
+
+""" apply a unitless function to numerical arguments, of which at least one is an array """
+def apply_vectorized(function, args, config):
+    ufunc = UFUNCS.get(function)
+    if ufunc is None:
+        ufunc = np.vectorize(function, otypes=[float])
+    return ArrayWithUnit.from_values(ufunc(*args), config)
+
+
+""" negative numbers have no real powers with fractional exponents, numpy would return NaN,
+while NumberWithUnit.__pow__ raises an exception """
+def check_real_power(base, power):
+    if np.any((np.asarray(base) < 0) & (np.asarray(power, dtype=float) % 1 != 0)):
+        raise UnitException("Result is not a real number: negative number to a fractional power")
+
+
+""" array of numbers sharing one unit, the unit is checked once per operation instead of once per element,
+'num' is a numpy array, everything else behaves like NumberWithUnit """
+class ArrayWithUnit(NumberWithUnit):
+    __slots__ = ()
+    __array_ufunc__ = None      # numpy arrays and scalars call the reflected operators instead of looping over us
+
+    def __init__(self, num, unit, base_units):
+        super().__init__(0, unit, base_units)
+        self.num = np.asarray(num, dtype=float)
+
+    @classmethod
+    def from_values(cls, values, config, unit=None):
+        num = np.asarray(values, dtype=float)
+        if unit is None:
+            return cls.from_exponents(num, (0,) * config.num_base_units, 1, config.base_units)
+        return cls.from_exponents(num * unit.num, unit.exponents, unit.denominator, unit.base_units)
+
+    def check_base_units(self, other):
+        if self.base_units is not other.base_units:
+            raise UnitException("Cannot combine numbers with different base units")
+
+    def same_unit(self, other):
+        return self.exponents == other.exponents and self.denominator == other.denominator
+
+    def __add__(self, other):
+        if not isinstance(other, NumberWithUnit):
+            raise UnitException("Cannot add unitless number to number with unit")
+        self.check_base_units(other)
+        if not self.same_unit(other):
+            raise UnitException(f"Cannot add units: {str(self)} + {str(other)}")
+        return ArrayWithUnit.from_exponents(self.num + other.num, self.exponents, self.denominator, self.base_units)
+
+    def __radd__(self, other):
+        return self.__add__(other)
+
+    def __sub__(self, other):
+        if not isinstance(other, NumberWithUnit):
+            raise UnitException("Cannot subtract unitless number from number with unit")
+        self.check_base_units(other)
+        if not self.same_unit(other):
+            raise UnitException(f"Cannot subtract units: {str(self)} + {str(other)}")
+        return ArrayWithUnit.from_exponents(self.num - other.num, self.exponents, self.denominator, self.base_units)
+
+    def __rsub__(self, other):
+        return (-self).__add__(other)
+
+    def __mul__(self, other):
+        if isinstance(other, NumberWithUnit):
+            self.check_base_units(other)
+            return ArrayWithUnit.combine_exponents(self, other, operator.add, self.num * other.num)
+        if isinstance(other, (int, float, np.number, np.ndarray)):
+            return ArrayWithUnit.from_exponents(self.num * other, self.exponents, self.denominator, self.base_units)
+        raise NotImplementedError()
+
+    def __rmul__(self, other):
+        return self.__mul__(other)
+
+    def __truediv__(self, other):
+        if isinstance(other, NumberWithUnit):
+            self.check_base_units(other)
+            return ArrayWithUnit.combine_exponents(self, other, operator.sub, self.num / other.num)
+        if isinstance(other, (int, float, np.number, np.ndarray)):
+            return ArrayWithUnit.from_exponents(self.num / other, self.exponents, self.denominator, self.base_units)
+        raise NotImplementedError()
+
+    def __rtruediv__(self, other):
+        if isinstance(other, NumberWithUnit):
+            self.check_base_units(other)
+            return ArrayWithUnit.combine_exponents(other, self, operator.sub, other.num / self.num)
+        if isinstance(other, (int, float, np.number, np.ndarray)):
+            exponents = tuple([-e for e in self.exponents])
+            return ArrayWithUnit.from_exponents(other / self.num, exponents, self.denominator, self.base_units)
+        raise NotImplementedError()
+
+    def __pow__(self, power):
+        if isinstance(power, NumberWithUnit):
+            self.check_base_units(power)
+            if not power.is_unitless():
+                raise UnitException("Cannot use unit in exponent: %s" % power)
+            power = power.num
+        if isinstance(power, np.ndarray):
+            if not self.is_unitless():
+                raise UnitException("Exponent of a number with unit has to be a scalar")
+            check_real_power(self.num, power)
+            return ArrayWithUnit.from_exponents(self.num ** power, self.exponents, 1, self.base_units)
+        if isinstance(power, float):
+            power = Fraction(power)
+        if isinstance(power, (int, Fraction)):
+            exponents = tuple([e * power.numerator for e in self.exponents])
+            denominator = self.denominator * power.denominator
+            check_real_power(self.num, float(power))
+            return ArrayWithUnit.normalized(self.num ** float(power), exponents, denominator, self.base_units)
+        raise NotImplementedError()
+
+    def __rpow__(self, base):
+        if isinstance(base, NumberWithUnit):
+            self.check_base_units(base)
+            if not self.is_unitless():
+                raise UnitException("Cannot use unit in exponent: %s" % self)
+            if not base.is_unitless():
+                raise UnitException("Exponent of a number with unit has to be a scalar")
+            check_real_power(base.num, self.num)
+            return ArrayWithUnit.from_exponents(base.num ** self.num, base.exponents, 1, base.base_units)
+        raise NotImplementedError()
+
+    def __neg__(self):
+        return ArrayWithUnit.from_exponents(-self.num, self.exponents, self.denominator, self.base_units)
+
+    def __eq__(self, other):
+        if not isinstance(other, NumberWithUnit):
+            return False
+        if self.base_units is not other.base_units or not self.same_unit(other):
+            return False
+        return bool(np.array_equal(self.num, other.num))
+
+    def __len__(self):
+        return len(self.num)
+
+    def __getitem__(self, index):
+        num = self.num[index]
+        if isinstance(num, np.ndarray):
+            return ArrayWithUnit.from_exponents(num, self.exponents, self.denominator, self.base_units)
+        return NumberWithUnit.from_exponents(float(num), self.exponents, self.denominator, self.base_units)
+
+    def __str__(self):
+        return f"{np.array2string(self.num, precision=12)}{self.unit_str()}"
+
+    def __repr__(self):
+        units = [str(u) for u in self.unit]
+        return f"ArrayWithUnit({self.num!r};{','.join(units)})"
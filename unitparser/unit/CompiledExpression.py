@@ -0,0 +1,101 @@
+from fractions import Fraction
+from unitparser.unit.NumberWithUnit import NumberWithUnit, UnitException
+
+
+""" part of an expression that depends on a variable, 'evaluate' takes the list of bound values """
+class Deferred:
+    __slots__ = ("evaluate",)
+
+    def __init__(self, evaluate):
+        self.evaluate = evaluate
+
+
+def is_deferred(arg):
+    if isinstance(arg, Deferred):
+        return True
+    if isinstance(arg, list):   # argument lists of functions
+        return any(isinstance(x, Deferred) for x in arg)
+    return False
+
+
+""" returns a function, that evaluates 'arg' for a list of bound values """
+def getter(arg):
+    if isinstance(arg, Deferred):
+        return arg.evaluate
+    if isinstance(arg, list):
+        getters = [getter(x) for x in arg]
+        return lambda values: [g(values) for g in getters]
+    return lambda values: arg
+
+
+""" parse 'data' once, all parts that do not depend on 'variables' are evaluated immediately,
+the remaining productions are combined into a plan, that is evaluated when calling the object """
+class CompiledExpression:
+    def __init__(self, unit_parser, data, variables=()):
+        self.data = data
+        self.variables = tuple(variables)
+        self.cfg = unit_parser.cfg
+        self.index = {name: i for i, name in enumerate(self.variables)}
+
+        parser = unit_parser.parser
+        id_terminal = parser.terminals["id"]
+        values = []
+        for prod, value in zip(parser.productions, unit_parser.values):
+            if prod.expansion == (id_terminal,):
+                values.append(self.bind_variable(value))
+            else:
+                values.append(self.defer(value))
+
+        result = parser.parse_compact(unit_parser.lexer.lex_stream(data), values=values)
+        if isinstance(result, Deferred):
+            self.constant = None
+            self.evaluate = result.evaluate
+        else:
+            self.constant = result
+            self.evaluate = lambda values: result
+
+    """ identifiers that name a variable are looked up at evaluation time, all others are resolved now """
+    def bind_variable(self, value):
+        def apply(name):
+            if name in self.index:
+                i = self.index[name]
+                return Deferred(lambda values: values[i])
+            return value(name)
+        return apply
+
+    """ wrap the value function of a production, it is only called now if none of its arguments is deferred """
+    @staticmethod
+    def defer(value):
+        if value is None:
+            return None
+
+        def apply(*args):
+            if not any(is_deferred(arg) for arg in args):
+                return value(*args)
+            getters = [getter(arg) for arg in args]
+            if len(getters) == 1:
+                get = getters[0]
+                return Deferred(lambda values: value(get(values)))
+            if len(getters) == 2:
+                get1, get2 = getters
+                return Deferred(lambda values: value(get1(values), get2(values)))
+            return Deferred(lambda values: value(*[g(values) for g in getters]))
+        return apply
+
+    def __call__(self, *args, **kwargs):
+        if len(args) + len(kwargs) != len(self.variables):
+            raise TypeError(f"Expected {len(self.variables)} values for {', '.join(self.variables)}")
+        values = list(args) + [None] * len(kwargs)
+        for name, value in kwargs.items():
+            if name not in self.index or self.index[name] < len(args):
+                raise TypeError(f"Unexpected or duplicate variable: {name}")
+            values[self.index[name]] = value
+        for i, value in enumerate(values):
+            if not isinstance(value, NumberWithUnit):
+                if not isinstance(value, (int, float, Fraction)):
+                    raise UnitException(f"Invalid value for {self.variables[i]}: {value}")
+                values[i] = NumberWithUnit.from_num(value, self.cfg)
+        return self.evaluate(values)
+
+    def __repr__(self):
+        return f"CompiledExpression({self.data!r}, variables={list(self.variables)})"
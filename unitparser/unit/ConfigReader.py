@@ -1,69 +1,293 @@
 import os
 import re
+import math
 import json
+import hashlib
 from fractions import Fraction
 from collections import namedtuple, OrderedDict
+from unitparser.parser.Parser import cache_directory, write_cache_file
 from unitparser.unit.NumberWithUnit import NumberWithUnit, UnitException
+from unitparser.unit.Dimension import Dimension, DimensionFallback
 
 BaseUnit = namedtuple("BaseUnit", ["name", "symbol"])
-DerivedUnit = namedtuple("DerivedUnit", ["name", "symbol", "value"])
+DerivedUnit = namedtuple("DerivedUnit", ["name", "symbol", "definition"])
 Prefix = namedtuple("Prefix", ["name", "symbol", "value"])
 PrefixUnit = namedtuple("PrefixUnit", ["prefix", "unit"])
-Constant = namedtuple("Constant", ["name", "symbol", "value"])
-UnitFunction = namedtuple("UnitFunction", ["name", "function", "num_args", "unitless"])
+Constant = namedtuple("Constant", ["name", "symbol", "definition"])
+UnitFunction = namedtuple("UnitFunction", ["name", "function", "num_args", "unitless", "dimension"], defaults=(False,))
+ResolvedUnit = namedtuple("ResolvedUnit", ["num", "exponents", "denominator"])
+
+SNAPSHOT_VERSION = 2
+
+
+""" bounded cache of resolved unit symbols, the least recently used entry is evicted when it is full """
+class UnitCache:
+    def __init__(self, max_size=4096):
+        self.max_size = max_size
+        self.data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    """ the cache can be used from several threads without a lock, entries may be evicted concurrently,
+    so missing keys are tolerated and the counters are approximate """
+    def get(self, key):
+        value = self.data.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        try:
+            self.data.move_to_end(key)
+        except KeyError:
+            pass
+        return value
+
+    def put(self, key, value):
+        self.data[key] = value
+        while len(self.data) > self.max_size:
+            try:
+                self.data.popitem(last=False)
+            except KeyError:
+                break
+            self.evictions += 1
+
+    def clear(self):
+        self.data.clear()
+
+    def stats(self):
+        return {"size": len(self.data), "max_size": self.max_size,
+                "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
 
 
 class ConfigReader:
-    def __init__(self, path):
-        with open(path) as f:
-            self.data = json.load(f)
+    def __init__(self, path, cache=True):
+        with open(path, "rb") as f:
+            content = f.read()
+        self.data = json.loads(content)
+        self.snapshot_path = None
+        if cache:
+            digest = hashlib.sha256(b"%d:" % SNAPSHOT_VERSION + content).hexdigest()[:32]
+            self.snapshot_path = os.path.join(cache_directory(), f"config-{digest}.json")
 
         self.base_units = [BaseUnit(*val) for val in self.data["base units"]]
         self.prefixes = [Prefix(*val) for val in self.data["prefixes"]]
         self.num_base_units = len(self.base_units)
         self.prefixes.append(Prefix(None, "", 1))
 
-        self.units = OrderedDict()
-        for pre in self.prefixes:
-            for unit in self.base_units:
-                self.add_unit(pre, unit)
+        self.prefix_symbols = {pre.symbol: pre for pre in self.prefixes}
+        self.prefix_lengths = sorted(set(len(pre.symbol) for pre in self.prefixes))
+
+        self.units = OrderedDict()              # symbols that take no prefix: constants and synonyms
+        self.prefixed_units = OrderedDict()     # base and derived units, combined with any prefix on lookup
+        self.removed = set()
+        self.unit_cache = UnitCache()
+        for unit in self.base_units:
+            self.add_prefixed_unit(unit)
 
         self.derived_units = None
         self.constants = None
-        self.unit_list = list(self.units.keys())
+        self.build_trie()
 
         self.functions = {}
+        self.instrumentation = None
+        self.unit_index = None
+        self.engineering_prefixes = sorted([pre for pre in self.prefixes if round(math.log10(pre.value)) % 3 == 0],
+                                           key=lambda pre: pre.value, reverse=True)
 
-    def load_derived_units(self, parse):
-        self.derived_units = [DerivedUnit(val[0], val[1], parse(val[2])) for val in self.data["derived units"]]
-        for pre in self.prefixes:
-            for unit in self.derived_units:
-                self.add_unit(pre, unit)
-
-    def load_constants(self, parse):
-        self.constants = [Constant(val[0], val[1], parse(val[2])) for val in self.data["constants"]]
+    """ register the derived units and constants, their definitions are only evaluated when they are first used,
+    'identifiers' returns the unit symbols in a definition and 'evaluate(definition, resolved)' evaluates it,
+    looking up these symbols in the dictionary 'resolved',
+    unknown or ambiguous symbols and cyclic definitions are reported here, without evaluating anything """
+    def load_definitions(self, identifiers, evaluate):
+        self.derived_units = [DerivedUnit(*val) for val in self.data["derived units"]]
+        for unit in self.derived_units:
+            self.add_prefixed_unit(unit)
+        self.constants = [Constant(*val) for val in self.data["constants"]]
         for const in self.constants:
             self.add_unit(self.prefixes[-1], const)
 
+        self.evaluate = evaluate
+        self.values = {}
+        self.references = {}
+        if self.load_snapshot():
+            return
+        self.build_trie()
+        for unit in self.derived_units + self.constants:
+            self.references[unit.symbol] = {symbol: self.resolve_reference(unit, symbol)
+                                            for symbol in identifiers(unit.definition)}
+        self.check_cycles()
+        self.save_snapshot()
+
+    """ the units, that 'symbol' stands for in the definition of 'unit', as PrefixUnit """
+    def resolve_reference(self, unit, symbol):
+        match = self.find_unit(symbol)
+        if match is not None:
+            return [match]
+        count, matches = self.decompose(symbol, limit=1)
+        if count == 0:
+            raise UnitException(f"Unknown unit in definition of {unit.name}: {symbol}")
+        if count > 1:
+            raise UnitException(f"Ambiguous unit in definition of {unit.name}: {symbol}")
+        return [self.find_unit(u) for u in matches[0]]
+
+    """ depth first search through the references, raises an exception listing the units of the first cycle """
+    def check_cycles(self):
+        done = set()
+        for start in self.references:
+            path = [start]
+            stack = [iter(self.dependencies(start))]
+            while len(stack) > 0:
+                symbol = next(stack[-1], None)
+                if symbol is None:
+                    done.add(path.pop())
+                    stack.pop()
+                elif symbol in path:
+                    cycle = path[path.index(symbol):] + [symbol]
+                    raise Exception("Cyclic definition: " + " -> ".join(cycle))
+                elif symbol not in done:
+                    path.append(symbol)
+                    stack.append(iter(self.dependencies(symbol)))
+
+    def dependencies(self, symbol):
+        return [match.unit.symbol for matches in self.references[symbol].values() for match in matches
+                if not isinstance(match.unit, BaseUnit)]
+
+    """ value of a derived unit or constant, it is evaluated on first use, after its dependencies,
+    concurrent first uses may evaluate it more than once, with the same result """
+    def unit_value(self, unit):
+        value = self.values.get(unit.symbol)
+        if value is None:
+            resolved = {}
+            for symbol, matches in self.references[unit.symbol].items():
+                if len(matches) == 1:
+                    resolved[symbol] = self.value_of(matches[0])
+                else:
+                    resolved[symbol] = NumberWithUnit.from_num(1, self)
+                    for match in matches:
+                        resolved[symbol] *= self.value_of(match)
+            value = self.evaluate(unit.definition, resolved)
+            self.values[unit.symbol] = value
+        return value
+
+    """ value of a PrefixUnit """
+    def value_of(self, match):
+        if isinstance(match.unit, BaseUnit):
+            idx = self.base_units.index(match.unit)
+            exponents = tuple([1 if idx == i else 0 for i in range(self.num_base_units)])
+            return NumberWithUnit.from_exponents(match.prefix.value, exponents, 1, self.base_units)
+        if isinstance(match.unit, DerivedUnit):
+            return match.prefix.value * self.unit_value(match.unit)
+        if isinstance(match.unit, Constant):
+            return self.unit_value(match.unit)
+        raise NotImplementedError()
+
+    """ load the values of the derived units and constants from the snapshot, written by a previous run with the
+    same config file, returns False if there is none, the snapshot is named after the hash of the file content,
+    so that it is not used after the file was changed """
+    def load_snapshot(self):
+        if self.snapshot_path is None:
+            return False
+        try:
+            with open(self.snapshot_path) as f:
+                data = json.load(f)
+            values = {unit.symbol: self.snapshot_value(data[unit.symbol])
+                      for unit in self.derived_units + self.constants}
+        except (OSError, ValueError, KeyError, TypeError):
+            return False
+        self.values = values
+        return True
+
+    """ entry of 'save_snapshot', the exponents have to be integers and the denominator a positive integer """
+    def snapshot_value(self, value):
+        num, exponents, denominator = value
+        if type(num) not in (int, float) or len(exponents) != self.num_base_units:
+            raise ValueError("Invalid snapshot entry")
+        if any(type(e) is not int for e in exponents) or type(denominator) is not int or denominator <= 0:
+            raise ValueError("Invalid exponents in snapshot entry")
+        return NumberWithUnit.from_exponents(num, tuple(exponents), denominator, self.base_units)
+
+    """ evaluate all definitions and write their values with write_cache_file, nothing is written if a definition
+    fails to evaluate, it then fails on first use, like without snapshot, and nothing is evaluated if the cache
+    directory cannot be written, e.g. on a read-only file system """
+    def save_snapshot(self):
+        if self.snapshot_path is None:
+            return
+        directory = os.path.dirname(self.snapshot_path)
+        try:
+            os.makedirs(directory, exist_ok=True)
+        except OSError:
+            return
+        if not os.access(directory, os.W_OK):
+            return
+        data = {}
+        try:
+            for unit in self.derived_units + self.constants:
+                value = self.unit_value(unit)
+                data[unit.symbol] = [value.num, value.exponents, value.denominator]
+        except Exception:
+            return
+        write_cache_file(self.snapshot_path, data)
+
     def finalize(self):
         for new, old in self.data["synonyms"].items():
-            self.units[new] = self.units[old]
+            match = self.find_unit(old)
+            if match is None:
+                raise KeyError(old)
+            self.units[new] = match
         for remove in self.data["remove"]:
-            self.units.pop(remove)
-        self.unit_list = list(self.units.keys())
+            if self.find_unit(remove) is None:
+                raise KeyError(remove)
+            self.units.pop(remove, None)
+            self.removed.add(remove)
+        self.build_trie()
+        self.unit_cache.clear()
+        self.unit_index = None
 
-    def add_unit(self, prefix, unit):
-        key = prefix.symbol + unit.symbol
-        if key in self.units:
-            ex = self.units[key]
+    def check_conflict(self, prefix, unit):
+        ex = self.find_unit(prefix.symbol + unit.symbol)
+        if ex is not None:
             raise Exception("Conflict between units: " +
                             f"{prefix.name}{unit.name.lower()} and {ex.prefix.name}{ex.unit.name.lower()}")
-        self.units[key] = PrefixUnit(prefix, unit)
 
-    def add_function(self, name, apply, num_args, unitless):
-        self.functions[name] = UnitFunction(name, apply, num_args, unitless)
+    """ add a symbol, that is not combined with prefixes """
+    def add_unit(self, prefix, unit):
+        self.check_conflict(prefix, unit)
+        self.units[prefix.symbol + unit.symbol] = PrefixUnit(prefix, unit)
+        self.unit_cache.clear()
+
+    """ add a unit, that can be combined with every prefix, the combinations are not stored but split up by
+    find_unit, they are only checked for conflicts with the existing symbols here """
+    def add_prefixed_unit(self, unit):
+        for prefix in self.prefixes:
+            self.check_conflict(prefix, unit)
+        self.prefixed_units[unit.symbol] = unit
+        self.unit_cache.clear()
+
+    """ returns the PrefixUnit of a symbol or None, conflicts are rejected when adding units,
+    so there is at most one way to split a symbol into prefix and unit """
+    def find_unit(self, symbol):
+        match = self.units.get(symbol)
+        if match is not None or symbol in self.removed:
+            return match
+        for length in self.prefix_lengths:
+            prefix = self.prefix_symbols.get(symbol[:length])
+            if prefix is not None:
+                unit = self.prefixed_units.get(symbol[length:])
+                if unit is not None:
+                    return PrefixUnit(prefix, unit)
+        return None
+
+    """ the dictionary of functions is replaced instead of modified, so that readers never see a partial update,
+    'dimension' marks functions, that can also be called with Dimension arguments, see function_dimension """
+    def add_function(self, name, apply, num_args, unitless, dimension=False):
+        functions = self.functions.copy()
+        functions[name] = UnitFunction(name, apply, num_args, unitless, dimension)
+        self.functions = functions
 
     def apply_function(self, name, args):
+        if self.instrumentation is not None:
+            self.instrumentation.count(f"function {name}")
         func = self.functions[name]
         if func.num_args != len(args):
             raise Exception("Wrong number of argument for function {name}")
@@ -72,18 +296,163 @@ class ConfigReader:
                 if not arg.is_unitless():
                     raise UnitException(f"Argument for {name} has to be unitless")
                 args[i] = arg.num
+            if not all(isinstance(arg, (int, float, Fraction)) for arg in args):
+                from unitparser.unit.ArrayWithUnit import apply_vectorized
+                return apply_vectorized(func.function, args, self)
         result = func.function(*args)
         if isinstance(result, (int, float, Fraction)):
             return NumberWithUnit.from_num(result, self)
         return result
 
-    """ finds all decompositions of a given string into unit, eg "Vs" -> ["V","s"] """
-    def find_decomposition(self, data):
+    """ dimension of a function call, see Dimension, unitless functions are not called, since their result is
+    always unitless, other functions are called with the Dimension objects of their arguments if they support them,
+    otherwise DimensionFallback is raised, since they may depend on the values of their arguments """
+    def function_dimension(self, name, args):
+        func = self.functions[name]
+        if func.num_args != len(args):
+            raise UnitException(f"Wrong number of arguments for function {name}")
+        if not func.unitless:
+            if not func.dimension:
+                raise DimensionFallback()
+            result = func.function(*args)
+            if isinstance(result, (int, float, Fraction)):
+                return Dimension.from_num(result, self)
+            return Dimension.of(result)
+        for arg in args:
+            if not arg.is_unitless():
+                raise UnitException(f"Argument for {name} has to be unitless")
+        return Dimension.from_num(None, self)
+
+    """ index from (exponents, denominator) to the units with that dimension, in the order of the config:
+    base units, derived units, constants, as (unit, value), units whose symbol does not refer to them are left out,
+    e.g. removed ones, the index is built on first use, so that finalize does not evaluate every definition """
+    def get_unit_index(self):
+        index = self.unit_index
+        if index is None:
+            index = {}
+            for unit in self.base_units + self.derived_units + self.constants:
+                match = self.find_unit(unit.symbol)
+                if match is not None and match.unit == unit:
+                    value = self.value_of(match)
+                    index.setdefault((value.exponents, value.denominator), []).append((unit, value.num))
+            self.unit_index = index     # published when complete, readers do not lock
+        return index
+
+    """ returns the number, prefix and unit, that express 'value' best, or None if no unit has its dimension,
+    the prefix is a multiple of 1000, so that the number is between 1 and 1000 if possible, numbers below the
+    smallest prefix get that prefix, for arrays the prefix is chosen by the element with the largest absolute value,
+    constants are only used if 'constants' is set and no base unit or derived unit fits,
+    unitless values are never expressed in units """
+    def best_unit(self, value, constants=False):
+        candidates = self.get_unit_index().get((value.exponents, value.denominator))
+        if candidates is None or value.is_unitless():
+            return None
+        for unit, unit_num in candidates:
+            if isinstance(unit, Constant):
+                if constants:
+                    return value.num / unit_num, self.prefixes[-1], unit
+                continue
+            num = value.num / unit_num
+            if hasattr(num, "max"):
+                magnitude = abs(num).max() if num.size else 0
+            else:
+                magnitude = abs(num)
+            if magnitude != 0:
+                for prefix in self.engineering_prefixes:
+                    if magnitude >= prefix.value * (1 - 1e-12) and self.has_prefix(prefix, unit):
+                        return num / prefix.value, prefix, unit
+                for prefix in reversed(self.engineering_prefixes):
+                    if self.has_prefix(prefix, unit):
+                        return num / prefix.value, prefix, unit
+            return num, self.prefixes[-1], unit
+        return None
+
+    """ whether the symbol of 'unit' with 'prefix' refers to the prefixed unit, it does not if e.g. it was removed """
+    def has_prefix(self, prefix, unit):
+        return self.find_unit(prefix.symbol + unit.symbol) == PrefixUnit(prefix, unit)
+
+    """ prefix trees of the prefixes, the prefixed units and the other symbols, the key None marks the end of a
+    symbol and holds a sort key, so that decompositions are listed in the order, in which the units were added:
+    base units and derived units with every prefix, followed by constants and synonyms """
+    def build_trie(self):
+        self.prefix_trie = self.make_trie((pre.symbol, i) for i, pre in enumerate(self.prefixes))
+        self.prefixed_trie = self.make_trie((symbol, (0 if isinstance(unit, BaseUnit) else 1, i))
+                                            for i, (symbol, unit) in enumerate(self.prefixed_units.items()))
+        self.unit_trie = self.make_trie((symbol, (2, i, 0)) for i, symbol in enumerate(self.units))
+
+    @staticmethod
+    def make_trie(items):
+        trie = {}
+        for symbol, value in items:
+            node = trie
+            for c in symbol:
+                node = node.setdefault(c, {})
+            node[None] = value
+        return trie
+
+    """ yields (end, value) for every symbol in 'trie', that starts at 'start' in 'data' """
+    @staticmethod
+    def match_trie(trie, data, start):
+        node = trie
+        if None in node:
+            yield start, node[None]
+        for j in range(start, len(data)):
+            node = node.get(data[j])
+            if node is None:
+                return
+            if None in node:
+                yield j + 1, node[None]
+
+    """ yields (end, sort key) for every unit, that starts at 'start' in 'data' """
+    def match_units(self, data, start):
+        yield from self.match_trie(self.unit_trie, data, start)
+        for middle, prefix_index in self.match_trie(self.prefix_trie, data, start):
+            for end, (group, index) in self.match_trie(self.prefixed_trie, data, middle):
+                symbol = data[start:end]
+                if symbol not in self.units and symbol not in self.removed:
+                    yield end, (group, prefix_index, index)
+
+    """ counts the decompositions of every suffix of 'data', working backwards from the end,
+    also returns for every position the units (sort key, end) that start there and can be completed """
+    def decomposition_graph(self, data):
+        counts = [0] * len(data) + [1]
+        edges = [None] * len(data)
+        for i in range(len(data) - 1, -1, -1):
+            found = []
+            for end, key in self.match_units(data, i):
+                if counts[end] > 0:
+                    found.append((key, end))
+                    counts[i] += counts[end]
+            found.sort()
+            edges[i] = found
+        return counts, edges
+
+    """ returns the number of decompositions of a given string into units, eg "Vs" -> ["V","s"],
+    and up to 'limit' of them """
+    def decompose(self, data, limit=None):
+        counts, edges = self.decomposition_graph(data)
         if len(data) == 0:
-            return [[]]
+            return 1, [[]]
         matches = []
-        for unit in self.unit_list:
-            if data.startswith(unit):
-                for match in self.find_decomposition(data[len(unit):]):
-                    matches.append([unit] + match)
-        return matches
+        units = []
+        stack = [(0, iter(edges[0]))]
+        while len(stack) > 0 and (limit is None or len(matches) < limit):
+            start, steps = stack[-1]
+            step = next(steps, None)
+            if step is None:
+                stack.pop()
+                if len(units) > 0:
+                    units.pop()
+                continue
+            end = step[1]
+            units.append(data[start:end])
+            if end == len(data):
+                matches.append(units.copy())
+                units.pop()
+            else:
+                stack.append((end, iter(edges[end])))
+        return counts[0], matches
+
+    """ finds all decompositions of a given string into unit, eg "Vs" -> ["V","s"] """
+    def find_decomposition(self, data, limit=None):
+        return self.decompose(data, limit)[1]
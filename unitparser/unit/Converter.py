@@ -0,0 +1,64 @@
+from fractions import Fraction
+from unitparser.unit.NumberWithUnit import NumberWithUnit, UnitException
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+FLOAT_FORMATS = ("d", "f", "@d", "@f")
+
+
+""" converts numbers given in units of 'source' to units of 'target',
+both units are checked once, afterwards a conversion is a single multiplication """
+class Converter:
+    def __init__(self, source, target):
+        ratio = source / target
+        if not ratio.is_unitless():
+            raise UnitException(f"Cannot express {str(source)} in units of {str(target)}")
+        self.source = source
+        self.target = target
+        self.factor = float(ratio.num)
+
+    """ convert a number, a sequence or a buffer of numbers,
+    writable float buffers (array.array, numpy arrays, memoryviews, ...) are converted in place and returned,
+    other numpy arrays are converted into a new array, other sequences and buffers into a new list """
+    def convert(self, values):
+        if isinstance(values, (int, float, Fraction)):
+            return values * self.factor
+        if isinstance(values, NumberWithUnit):
+            raise UnitException("Converter expects plain numbers, use in_units_of for numbers with unit")
+        if np is not None and isinstance(values, np.ndarray):
+            if values.flags.writeable and np.issubdtype(values.dtype, np.floating):
+                return np.multiply(values, self.factor, out=values)
+            return values * self.factor
+        try:
+            view = memoryview(values)
+        except TypeError:
+            return [value * self.factor for value in values]
+        if view.ndim == 0:
+            return view.tolist() * self.factor
+        if view.readonly or view.format not in FLOAT_FORMATS or not view.c_contiguous:
+            if view.ndim != 1:
+                raise TypeError("Only writable float buffers can have more than one dimension")
+            return [value * self.factor for value in view.tolist()]
+        self.scale_in_place(view)
+        return values
+
+    def scale_in_place(self, view):
+        if np is not None:
+            array = np.asarray(view)
+            array *= self.factor
+            return
+        if view.ndim != 1:
+            view = view.cast("B").cast(view.format.lstrip("@"))
+        factor = self.factor
+        for i in range(len(view)):
+            view[i] *= factor
+
+    def __call__(self, values):
+        return self.convert(values)
+
+    def __repr__(self):
+        return f"Converter({str(self.source)} -> {str(self.target)}, factor={self.factor:.12g})"
@@ -0,0 +1,152 @@
+import operator
+from fractions import Fraction
+from unitparser.unit.NumberWithUnit import NumberWithUnit, UnitException
+
+
+""" raised when the dimension of an expression depends on a number, that was not computed,
+e.g. "m^sqrt(4)", the expression is then evaluated completely """
+class DimensionFallback(Exception):
+    pass
+
+
+""" apply 'op' to two numbers, that may be unknown (None) """
+def num_op(op, first, second):
+    if first is None or second is None:
+        return None
+    try:
+        return op(first, second)
+    except ZeroDivisionError:
+        return None
+
+
+""" the unit of an expression without its value, the exponents are computed like for NumberWithUnit,
+'num' is only kept while the expression is unitless and consists of numbers, since only then it can be used
+as exponent, otherwise it is None """
+class Dimension(NumberWithUnit):
+    __slots__ = ()
+
+    @classmethod
+    def of(cls, value):
+        num = value.num if value.is_unitless() else None
+        return cls.from_exponents(num, value.exponents, value.denominator, value.base_units)
+
+    @classmethod
+    def from_num(cls, num, config):
+        return cls.from_exponents(num, (0,) * config.num_base_units, 1, config.base_units)
+
+    @classmethod
+    def from_unit(cls, unit, config, num=1):
+        return cls.of(NumberWithUnit.from_unit(unit, config))
+
+    """ dimensions are only combined with dimensions, a NumberWithUnit operand has a value, that would be lost """
+    def check(self, other):
+        if not isinstance(other, Dimension):
+            raise UnitException(f"Cannot combine dimension {str(self)} with a number")
+        if self.base_units is not other.base_units:
+            raise UnitException("Cannot combine numbers with different base units")
+
+    def __add__(self, other):
+        if not isinstance(other, NumberWithUnit):
+            raise UnitException("Cannot add unitless number to number with unit")
+        self.check(other)
+        if self.exponents != other.exponents or self.denominator != other.denominator:
+            raise UnitException(f"Cannot add units: {str(self)} + {str(other)}")
+        return Dimension.from_exponents(num_op(operator.add, self.num, other.num), self.exponents, self.denominator,
+                                        self.base_units)
+
+    def __sub__(self, other):
+        if not isinstance(other, NumberWithUnit):
+            raise UnitException("Cannot subtract unitless number from number with unit")
+        self.check(other)
+        if self.exponents != other.exponents or self.denominator != other.denominator:
+            raise UnitException(f"Cannot subtract units: {str(self)} + {str(other)}")
+        return Dimension.from_exponents(num_op(operator.sub, self.num, other.num), self.exponents, self.denominator,
+                                        self.base_units)
+
+    def __mul__(self, other):
+        if isinstance(other, NumberWithUnit):
+            self.check(other)
+            return Dimension.combine_exponents(self, other, operator.add, num_op(operator.mul, self.num, other.num))
+        if isinstance(other, (int, float)):
+            return Dimension.from_exponents(num_op(operator.mul, self.num, other), self.exponents, self.denominator,
+                                            self.base_units)
+        raise NotImplementedError()
+
+    def __truediv__(self, other):
+        if isinstance(other, NumberWithUnit):
+            self.check(other)
+            return Dimension.combine_exponents(self, other, operator.sub, num_op(operator.truediv, self.num, other.num))
+        if isinstance(other, (int, float)):
+            return Dimension.from_exponents(num_op(operator.truediv, self.num, other), self.exponents,
+                                            self.denominator, self.base_units)
+        raise NotImplementedError()
+
+    def __pow__(self, power):
+        if isinstance(power, NumberWithUnit):
+            self.check(power)
+            if not power.is_unitless():
+                raise UnitException("Cannot use unit in exponent: %s" % power)
+            if self.is_unitless() and (self.num is None or power.num is None):
+                return Dimension.from_exponents(None, self.exponents, 1, self.base_units)   # still unitless
+            if power.num is None:
+                raise DimensionFallback()
+            power = power.num
+        num = num_op(operator.pow, self.num, power)
+        if isinstance(num, complex):
+            raise UnitException(f"Result is not a real number: ({self.num})^{float(power):g}")
+        if isinstance(power, float):
+            power = Fraction(power)
+        if isinstance(power, int):
+            exponents = tuple([e * power for e in self.exponents])
+            return Dimension.normalized(num, exponents, self.denominator, self.base_units)
+        if isinstance(power, Fraction):
+            exponents = tuple([e * power.numerator for e in self.exponents])
+            return Dimension.normalized(num, exponents, self.denominator * power.denominator, self.base_units)
+        raise NotImplementedError()
+
+    def __rmul__(self, other):
+        return self.__mul__(other)
+
+    def __rtruediv__(self, other):
+        if isinstance(other, NumberWithUnit):
+            self.check(other)
+        if isinstance(other, (int, float)):
+            exponents = tuple([-e for e in self.exponents])
+            return Dimension.from_exponents(num_op(operator.truediv, other, self.num), exponents, self.denominator,
+                                            self.base_units)
+        raise NotImplementedError()
+
+    """ Python tries the reflected methods of a subclass first, so these reject NumberWithUnit operands,
+    before NumberWithUnit.__add__ etc. would use the missing number """
+    def __radd__(self, other):
+        self.check(other)
+        raise NotImplementedError()
+
+    def __rsub__(self, other):
+        self.check(other)
+        raise NotImplementedError()
+
+    def __rpow__(self, other):
+        self.check(other)
+        raise NotImplementedError()
+
+    def __neg__(self):
+        return Dimension.from_exponents(None if self.num is None else -self.num, self.exponents, self.denominator,
+                                        self.base_units)
+
+    """ dimensions are equal if their units are equal, regardless of the values, they are never equal to a number """
+    def __eq__(self, other):
+        if not isinstance(other, Dimension):
+            return False
+        return self.base_units is other.base_units and self.exponents == other.exponents \
+            and self.denominator == other.denominator
+
+    def __hash__(self):
+        return hash((self.exponents, self.denominator))
+
+    def __str__(self):
+        return self.unit_str().strip()
+
+    def __repr__(self):
+        units = [str(u) for u in self.unit]
+        return f"Dimension({','.join(units)})"
@@ -0,0 +1,54 @@
+from time import perf_counter
+
+
+""" counters and timers of the phases of parsing, enabled by UnitParser.enable_instrumentation,
+like UnitCache it is updated without a lock, so the numbers are approximate when parsing from several threads """
+class Instrumentation:
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.counters = {}
+        self.timers = {}
+        self.values = None
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def add_time(self, name, seconds):
+        timer = self.timers.get(name)
+        if timer is None:
+            self.timers[name] = [1, seconds]
+        else:
+            timer[0] += 1
+            timer[1] += seconds
+
+    """ wrap the value functions of the productions, so that every reduce is counted and timed """
+    def instrument_values(self, productions, values):
+        self.values = []
+        for prod, value in zip(productions, values):
+            name = f"reduce {prod.target.name} -> {' '.join(symbol.name for symbol in prod.expansion)}"
+            self.values.append(self.timed(name, value) if value is not None else None)
+
+    def timed(self, name, function):
+        def apply(*args):
+            start = perf_counter()
+            try:
+                return function(*args)
+            finally:
+                self.add_time(name, perf_counter() - start)
+        return apply
+
+    """ called by UnitParser.parse for every parsed string, 'record' holds the measurements of this call """
+    def report(self, record):
+        if self.callback is not None:
+            self.callback(record)
+
+    def reset(self):
+        self.counters = {}
+        self.timers = {}
+
+    """ copy of all counters and timers, timers are reported as number of calls and total time in seconds """
+    def stats(self):
+        return {
+            "counters": dict(self.counters),
+            "timers": {name: {"count": count, "total": total} for name, (count, total) in list(self.timers.items())}
+        }
@@ -1,142 +1,220 @@
+import operator
+from math import gcd, lcm
 from fractions import Fraction
 from unitparser.unit import ConfigReader
 
 
+""" 'pos' is set by the parser to the position of the start of the expression that could not be evaluated """
 class UnitException(Exception):
-    pass
+    pos = None
 
 
+AMBIGUITY_LIMIT = 10    # maximum number of decompositions listed for an ambiguous unit
+
+
+""" same as str(Fraction(numerator, denominator)), without constructing the fraction """
+def fraction_str(numerator, denominator):
+    if denominator == 1:
+        return str(numerator)
+    divisor = gcd(numerator, denominator)
+    if divisor == denominator:
+        return str(numerator // divisor)
+    return f"{numerator // divisor}/{denominator // divisor}"
+
+
+""" the unit is stored as integer exponents of the base units, scaled by a common denominator,
+the denominator is kept minimal, so that equal units have equal exponents """
 class NumberWithUnit:
+    __slots__ = ("num", "exponents", "denominator", "base_units")
+
     def __init__(self, num, unit, base_units):
         assert isinstance(num, (int, float, Fraction)), f"{num} {type(num)}"
-        self.num = num
-        self.unit = tuple(unit)
         for u in unit:
             if not isinstance(u, Fraction):
                 raise Exception(f"Invalid unit argument: {u}")
+        denominator = lcm(*[u.denominator for u in unit])
+        self.num = num
+        self.exponents = tuple([u.numerator * (denominator // u.denominator) for u in unit])
+        self.denominator = denominator
+        self.base_units = base_units
+
+    """ construct without validation, 'exponents' and 'denominator' have to be normalized """
+    @classmethod
+    def from_exponents(cls, num, exponents, denominator, base_units):
+        self = object.__new__(cls)
+        self.num = num
+        self.exponents = exponents
+        self.denominator = denominator
         self.base_units = base_units
+        return self
+
+    """ reduce exponents and denominator by their greatest common divisor """
+    @classmethod
+    def normalized(cls, num, exponents, denominator, base_units):
+        divisor = gcd(denominator, *exponents)
+        if divisor != 1:
+            exponents = tuple([e // divisor for e in exponents])
+            denominator //= divisor
+        return cls.from_exponents(num, exponents, denominator, base_units)
+
+    """ exponents of the base units as fractions """
+    @property
+    def unit(self):
+        return tuple([Fraction(e, self.denominator) for e in self.exponents])
 
     @classmethod
     def from_num(cls, num, config):
-        return NumberWithUnit(num, (Fraction(0),)*config.num_base_units, config.base_units)
+        return NumberWithUnit.from_exponents(num, (0,) * config.num_base_units, 1, config.base_units)
 
+    """ look up a unit symbol, resolved symbols are cached in the config """
     @classmethod
     def from_unit(cls, unit, config, num=1):
-        if unit in config.units:
-            match = config.units[unit]
-            if isinstance(match.unit, ConfigReader.BaseUnit):
-                idx = config.base_units.index(match.unit)
-                unit_vec = [Fraction(1 if idx == i else 0) for i in range(config.num_base_units)]
-                return NumberWithUnit(num * match.prefix.value, unit_vec, config.base_units)
-            if isinstance(match.unit, ConfigReader.DerivedUnit):
-                return num * match.prefix.value * match.unit.value
-            if isinstance(match.unit, ConfigReader.Constant):
-                return num * match.unit.value
-            raise NotImplementedError()
-        matches = config.find_decomposition(unit)
-        if len(matches) == 1:
-            ret = NumberWithUnit.from_num(num, config)
+        resolved = config.unit_cache.get(unit)
+        if resolved is None:
+            value = NumberWithUnit.resolve_unit(unit, config)
+            resolved = ConfigReader.ResolvedUnit(value.num, value.exponents, value.denominator)
+            config.unit_cache.put(unit, resolved)
+        if num != 1:
+            num = resolved.num * num
+        else:
+            num = resolved.num
+        return NumberWithUnit.from_exponents(num, resolved.exponents, resolved.denominator, config.base_units)
+
+    @classmethod
+    def resolve_unit(cls, unit, config):
+        match = config.find_unit(unit)
+        if match is not None:
+            return config.value_of(match)
+        if config.instrumentation is not None:
+            config.instrumentation.count("decompositions")
+        count, matches = config.decompose(unit, limit=AMBIGUITY_LIMIT)
+        if count == 1:
+            ret = NumberWithUnit.from_num(1, config)
             for u in matches[0]:
                 ret *= NumberWithUnit.from_unit(u, config)
             return ret
-        if len(matches) > 1:
+        if count > 1:
             possible_matches = [" ".join(match) for match in matches]
-            raise UnitException(f"Ambiguous unit: {unit}: ({') or ('.join(possible_matches)})")
+            more = f" or {count - len(matches)} more" if count > len(matches) else ""
+            raise UnitException(f"Ambiguous unit: {unit}: ({') or ('.join(possible_matches)}){more}")
         raise UnitException("Unknown unit: %s" % unit)
 
     def __add__(self, other):
         if not isinstance(other, NumberWithUnit):
             raise UnitException("Cannot add unitless number to number with unit")
-        if id(self.base_units) != id(other.base_units):
+        if self.base_units is not other.base_units:
             raise UnitException("Cannot combine numbers with different base units")
-        for i in range(len(self.unit)):
-            if self.unit[i] != other.unit[i]:
-                raise UnitException(f"Cannot add units: {str(self)} + {str(other)}")
-        return NumberWithUnit(self.num + other.num, self.unit, self.base_units)
+        if self.exponents != other.exponents or self.denominator != other.denominator:
+            raise UnitException(f"Cannot add units: {str(self)} + {str(other)}")
+        return NumberWithUnit.from_exponents(self.num + other.num, self.exponents, self.denominator, self.base_units)
 
     def __sub__(self, other):
         if not isinstance(other, NumberWithUnit):
             raise UnitException("Cannot subtract unitless number from number with unit")
-        if id(self.base_units) != id(other.base_units):
+        if self.base_units is not other.base_units:
             raise UnitException("Cannot combine numbers with different base units")
-        for i in range(len(self.unit)):
-            if self.unit[i] != other.unit[i]:
-                raise UnitException(f"Cannot subtract units: {str(self)} + {str(other)}")
-        return NumberWithUnit(self.num - other.num, self.unit, self.base_units)
+        if self.exponents != other.exponents or self.denominator != other.denominator:
+            raise UnitException(f"Cannot subtract units: {str(self)} + {str(other)}")
+        return NumberWithUnit.from_exponents(self.num - other.num, self.exponents, self.denominator, self.base_units)
+
+    """ combine the exponents of two numbers with 'op', rescaling them to a common denominator if necessary,
+    the result is an instance of 'cls' with value 'num' """
+    @classmethod
+    def combine_exponents(cls, first, second, op, num):
+        if first.denominator == second.denominator:
+            exponents = tuple(map(op, first.exponents, second.exponents))
+            if first.denominator == 1:
+                return cls.from_exponents(num, exponents, 1, first.base_units)
+            return cls.normalized(num, exponents, first.denominator, first.base_units)
+        denominator = lcm(first.denominator, second.denominator)
+        scale1 = denominator // first.denominator
+        scale2 = denominator // second.denominator
+        exponents = tuple([op(a * scale1, b * scale2) for a, b in zip(first.exponents, second.exponents)])
+        return cls.normalized(num, exponents, denominator, first.base_units)
 
     def __mul__(self, other):
         if isinstance(other, NumberWithUnit):
-            if id(self.base_units) != id(other.base_units):
+            if self.base_units is not other.base_units:
                 raise Exception("Cannot combine numbers with different base units")
-            unit_vec = [self.unit[i] + other.unit[i] for i in range(len(self.unit))]
-            return NumberWithUnit(self.num * other.num, unit_vec, self.base_units)
+            return NumberWithUnit.combine_exponents(self, other, operator.add, self.num * other.num)
         if isinstance(other, (int, float)):
-            return NumberWithUnit(self.num * other, self.unit, self.base_units)
+            return NumberWithUnit.from_exponents(self.num * other, self.exponents, self.denominator, self.base_units)
         raise NotImplementedError()
 
     def __truediv__(self, other):
         if isinstance(other, NumberWithUnit):
-            if id(self.base_units) != id(other.base_units):
+            if self.base_units is not other.base_units:
                 raise UnitException("Cannot combine numbers with different base units")
-            unit_vec = [self.unit[i] - other.unit[i] for i in range(len(self.unit))]
-            return NumberWithUnit(self.num / other.num, unit_vec, self.base_units)
+            return NumberWithUnit.combine_exponents(self, other, operator.sub, self.num / other.num)
         if isinstance(other, (int, float)):
-            return NumberWithUnit(self.num / other, self.unit, self.base_units)
+            return NumberWithUnit.from_exponents(self.num / other, self.exponents, self.denominator, self.base_units)
         raise NotImplementedError()
 
     def __pow__(self, power):
         if isinstance(power, NumberWithUnit):
-            if id(self.base_units) != id(power.base_units):
+            if self.base_units is not power.base_units:
                 raise UnitException("Cannot combine numbers with different base units")
             if not power.is_unitless():
                 raise UnitException("Cannot use unit in exponent: %s" % power)
             return self.__pow__(power.num)
         if isinstance(power, float):
             power = Fraction(power)
-        if isinstance(power, (int, Fraction)):
-            unit_vec = [u * power for u in self.unit]
-            return NumberWithUnit(self.num ** power, unit_vec, self.base_units)
+        if isinstance(power, int):
+            exponents = tuple([e * power for e in self.exponents])
+            return NumberWithUnit.normalized(self.power_num(power), exponents, self.denominator, self.base_units)
+        if isinstance(power, Fraction):
+            exponents = tuple([e * power.numerator for e in self.exponents])
+            denominator = self.denominator * power.denominator
+            return NumberWithUnit.normalized(self.power_num(power), exponents, denominator, self.base_units)
         raise NotImplementedError()
 
+    """ the only operation, that can turn real numbers into a complex number, e.g. (-8)^(1/3) """
+    def power_num(self, power):
+        num = self.num ** power
+        if isinstance(num, complex):
+            raise UnitException(f"Result is not a real number: ({self.num})^{float(power):g}")
+        return num
+
     def __rmul__(self, other):
         if isinstance(other, (int, float)):
-            return NumberWithUnit(self.num * other, self.unit, self.base_units)
+            return NumberWithUnit.from_exponents(self.num * other, self.exponents, self.denominator, self.base_units)
         raise NotImplementedError()
 
     def __rtruediv__(self, other):
         if isinstance(other, (int, float)):
-            return NumberWithUnit(other / self.num, [-u for u in self.unit], self.base_units)
+            exponents = tuple([-e for e in self.exponents])
+            return NumberWithUnit.from_exponents(other / self.num, exponents, self.denominator, self.base_units)
         raise NotImplementedError()
 
     def __neg__(self):
-        return NumberWithUnit(-self.num, self.unit, self.base_units)
+        return NumberWithUnit.from_exponents(-self.num, self.exponents, self.denominator, self.base_units)
 
     def __eq__(self, other):
         if not isinstance(other, NumberWithUnit):
             return False
-        if id(self.base_units) != id(other.base_units):
+        if self.base_units is not other.base_units:
+            return False
+        if self.exponents != other.exponents or self.denominator != other.denominator:
             return False
-        for a, b in zip(self.unit, other.unit):
-            if a != b:
-                return False
         return self.num == other.num
 
     def __str__(self):
+        return f"{float(self.num):.12g}{self.unit_str()}"
+
+    """ unit in terms of base units, with a leading space unless unitless """
+    def unit_str(self):
         unit_str = ""
-        for i in range(len(self.unit)):
-            if self.unit[i].numerator != 0:
-                if self.unit[i].numerator == self.unit[i].denominator:
-                    unit_str += f" {self.base_units[i].symbol}"
+        for symbol, e in zip(self.base_units, self.exponents):
+            if e != 0:
+                if e == self.denominator:
+                    unit_str += f" {symbol.symbol}"
                 else:
-                    unit_str += f" {self.base_units[i].symbol}^{str(self.unit[i])}"
-        return f"{float(self.num):.12g}{unit_str}"
+                    unit_str += f" {symbol.symbol}^{fraction_str(e, self.denominator)}"
+        return unit_str
 
     def __repr__(self):
-        units = [str(u) for u in self.unit]
+        units = [fraction_str(e, self.denominator) for e in self.exponents]
         return f"NumberWithUnit({self.num};{','.join(units)})"
 
     def is_unitless(self):
-        for unit in self.unit:
-            if unit.numerator != 0:
-                return False
-        return True
+        return not any(self.exponents)
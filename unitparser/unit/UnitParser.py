@@ -1,31 +1,71 @@
 import os
-import re
 import math
-from unitparser.parser.Lexer import Lexer, LexerToken, TokenType
-from unitparser.parser.Parser import Parser, GrammarRule
+import threading
+from time import perf_counter
+from collections import namedtuple
+from unitparser.parser.Lexer import Lexer, LexerToken, LexerException
+from unitparser.parser.Parser import Parser, GrammarRule, ParserException
 from unitparser.unit import ConfigReader
-from unitparser.unit.NumberWithUnit import NumberWithUnit
+from unitparser.unit.NumberWithUnit import NumberWithUnit, UnitException
+from unitparser.unit.CompiledExpression import CompiledExpression
+from unitparser.unit.Instrumentation import Instrumentation
+from unitparser.unit.Dimension import Dimension, DimensionFallback
+
+ParseError = namedtuple("ParseError", ["kind", "pos", "exception"])
+
+ERROR_KINDS = ((LexerException, "lexer"), (ParserException, "syntax"), (UnitException, "unit"))
+
+
+LEXER_TOKENS = [
+    LexerToken("num",   r"(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?", float),
+    LexerToken("id",    "[a-zA-Z][a-zA-Z0-9]*", str),
+    LexerToken("open",  "\\("),
+    LexerToken("close", "\\)"),
+    LexerToken("add",   "\\+|\\-", lambda x: x == "+"),
+    LexerToken("mul",   "\\*|/", lambda x: x == "*"),
+    LexerToken("pow",   "\\*\\*|\\^"),
+    LexerToken("comma", ","),
+    LexerToken("func",  "", str),   # to be filled in after loading functions
+    LexerToken("space", " |\t", ignore=True)
+]
 
 
 class UnitParser:
-    def __init__(self, path=None):
+    shared_grammars = {}
+    shared_lock = threading.Lock()
+
+    """ 'cache' enables the files cached on disk, the parse table, see Parser.load_table, and the snapshot of the
+    evaluated config, see ConfigReader.load_snapshot, without it, nothing is read or written there, the parse table
+    is built once per process and derived units and constants are evaluated on first use """
+    def __init__(self, path=None, cache=True):
         if path is None:
             from unitparser import unit
             path = os.path.join(unit.__path__[0], "config.json")
 
-        lexer_tokens = [
-            LexerToken("num",   r"(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?", float),
-            LexerToken("id",    "[a-zA-Z][a-zA-Z0-9]*", str),
-            LexerToken("open",  "\\("),
-            LexerToken("close", "\\)"),
-            LexerToken("add",   "\\+|\\-", lambda x: x == "+"),
-            LexerToken("mul",   "\\*|/", lambda x: x == "*"),
-            LexerToken("pow",   "\\*\\*|\\^"),
-            LexerToken("comma", ","),
-            LexerToken("func",  "", str),   # to be filled in after loading functions
-            LexerToken("space", " |\t", ignore=True)
-        ]
+        grammar_rules = self.grammar_rules()
+        self.values = [None] + [rule.value for rule in grammar_rules]     # indexed by production id
+        self.lexer, self.parser = UnitParser.compiled_grammar(grammar_rules, cache)
+        self.id_production = self.production_id("id")
+        self.dimension_values = list(self.values)
+        self.dimension_values[self.production_id("num")] = lambda val: Dimension.from_num(val, self.cfg)
+        self.dimension_values[self.id_production] = lambda val: Dimension.from_unit(val, self.cfg)
+        self.dimension_values[self.production_id("func", "open", "ARGS", "close")] = \
+            lambda fun, e: self.cfg.function_dimension(fun, e)
+        self.syntax_values = [lambda *args: None] * len(self.values)   # only check the structure of an expression
+        self.dimension_cache = ConfigReader.UnitCache()
+        self.result_cache = None
+        self.instrumentation = None
+        self.registration_lock = threading.Lock()
+
+        self.cfg = ConfigReader.ConfigReader(path, cache)
+        self.load_default_functions()
+        self.update_functions()
+        self.definition_lexer = self.lexer     # functions added later must not change the meaning of definitions
+        self.cfg.load_definitions(self.identifiers, self.evaluate_definition)
+        self.cfg.finalize()
 
+    """ grammar rules, the values are bound to this instance """
+    def grammar_rules(self):
         use_ambiguous_grammar = False
 
         if use_ambiguous_grammar:
@@ -63,15 +103,27 @@ class UnitParser:
                 GrammarRule("ARGS", "ARGS comma EXP", lambda e1, e2: e1 + [e2])
             ]
 
-        self.lexer = Lexer(lexer_tokens)
-        self.parser = Parser(grammar_rules, lexer_tokens)
+        return grammar_rules
 
-        self.cfg = ConfigReader.ConfigReader(path)
-        self.load_default_functions()
-        self.update_functions()
-        self.cfg.load_derived_units(self.parse)
-        self.cfg.load_constants(self.parse)
-        self.cfg.finalize()
+    """ the lexer and parser only depend on the grammar, not on the config, so they are compiled once per process
+    and shared by all instances, the productions of the shared parser have no values, these are passed on every
+    parse from 'self.values', the lexer is copied by update_functions before it is modified,
+    'cache' enables the cached parse table, see Parser.load_table """
+    @classmethod
+    def compiled_grammar(cls, grammar_rules, cache=True):
+        key = (Parser.grammar_hash(grammar_rules, LEXER_TOKENS), cache)
+        with cls.shared_lock:
+            if key not in cls.shared_grammars:
+                rules = [rule._replace(value=None) for rule in grammar_rules]
+                cls.shared_grammars[key] = (Lexer(LEXER_TOKENS), Parser(rules, LEXER_TOKENS, cache))
+            return cls.shared_grammars[key]
+
+    """ id of the production with the given expansion """
+    def production_id(self, *expansion):
+        for prod in self.parser.productions:
+            if tuple(symbol.name for symbol in prod.expansion) == expansion:
+                return prod.id
+        raise KeyError(expansion)
 
     """ load predefined units """
     def load_default_functions(self):
@@ -83,18 +135,201 @@ class UnitParser:
         self.cfg.add_function("log2", math.log2, 1, True)
         self.cfg.add_function("log10", math.log10, 1, True)
 
-        self.cfg.add_function("sqrt", lambda x: x**0.5, 1, False)
-        self.cfg.add_function("pow", lambda x, y: x ** y, 2, False)
+        self.cfg.add_function("sqrt", lambda x: x**0.5, 1, False, dimension=True)
+        self.cfg.add_function("pow", lambda x, y: x ** y, 2, False, dimension=True)
 
     """ update lexer, after adding new functions """
     def update_functions(self):
         pattern = "|".join(sorted(self.cfg.functions.keys(), key=len, reverse=True))
-        for i, token in enumerate(self.lexer.tokens):
-            if token.name == "func":
-                self.lexer.tokens[i] = TokenType("func", re.compile(pattern), str, False)
-                break
+        self.lexer = self.lexer.replace_token("func", pattern)
+        if self.result_cache is not None:
+            self.result_cache = ConfigReader.UnitCache(self.result_cache.max_size)
+        self.dimension_cache = ConfigReader.UnitCache(self.dimension_cache.max_size)
+
+    """ unit symbols in 'data', raises ParserException if 'data' is not a valid expression,
+    so that definitions of the config are checked on load, although they are evaluated later """
+    def identifiers(self, data):
+        tokens = self.definition_lexer.lex(data)
+        self.parser.parse_compact(tokens, data, values=self.syntax_values)
+        return [token.value for token in tokens if token.name == "id"]
+
+    """ evaluate a definition of the config, the unit symbols are looked up in 'resolved',
+    it is lexed like on load, without the functions that were added since """
+    def evaluate_definition(self, data, resolved):
+        values = list(self.values)
+        values[self.id_production] = lambda symbol: resolved[symbol]
+        return self.parser.parse_compact(self.definition_lexer.lex_stream(data), data, values=values)
+
+    """ register a function and update the lexer, registrations are serialized by a lock,
+    while parsing threads keep using the lexer and functions they started with, without locking """
+    def add_function(self, name, function, num_args, unitless):
+        with self.registration_lock:
+            self.cfg.add_function(name, function, num_args, unitless)
+            self.update_functions()
+
+    """ enable a cache of parse results with at most 'max_size' entries, 0 or None disables it,
+    results are keyed by their tokens, so that e.g. "kg  m" and "kg m" share an entry """
+    def set_result_cache(self, max_size):
+        if not max_size:
+            self.result_cache = None
+        else:
+            self.result_cache = ConfigReader.UnitCache(max_size)
+
+    """ count and time the phases of every call of 'parse', 'callback' is called with a dictionary of the
+    measurements of each call, see Instrumentation, when disabled (default) parsing is not slowed down """
+    def enable_instrumentation(self, callback=None):
+        instrumentation = Instrumentation(callback)
+        instrumentation.instrument_values(self.parser.productions, self.values)
+        self.instrumentation = instrumentation
+        self.cfg.instrumentation = instrumentation
+        return instrumentation
+
+    def disable_instrumentation(self):
+        self.instrumentation = None
+        self.cfg.instrumentation = None
 
     """ parse a string representing a number with unit """
     def parse(self, data, debug=False):
+        if self.instrumentation is not None and not debug:
+            return self.parse_instrumented(data, self.instrumentation)
+        cache = self.result_cache
+        if cache is not None and not debug:
+            return self.parse_cached(data, cache)
+        lex = self.lexer.lex_stream(data)
+        if debug:
+            return self.parser.parse(lex, debug=debug, values=self.values)
+        return self.parser.parse_compact(lex, values=self.values)
+
+    """ the cache holds immutable ResolvedUnit entries, every call returns a new object """
+    def parse_cached(self, data, cache):
+        lex = self.lexer.lex(data)
+        key = tuple([(token.name, token.value) for token in lex])
+        resolved = cache.get(key)
+        if resolved is not None:
+            return NumberWithUnit.from_exponents(resolved.num, resolved.exponents, resolved.denominator,
+                                                 self.cfg.base_units)
+        result = self.parser.parse_compact(lex, values=self.values)
+        if type(result) is NumberWithUnit:
+            cache.put(key, ConfigReader.ResolvedUnit(result.num, result.exponents, result.denominator))
+        return result
+
+    """ same as parse, measuring lexing and parsing separately, the reduce steps are timed by the wrapped values """
+    def parse_instrumented(self, data, instrumentation):
+        record = {"data": data, "lex": 0.0, "parse": 0.0, "tokens": 0, "cached": False, "error": None}
+        start = perf_counter()
+        try:
+            lex = self.lexer.lex(data)
+            lexed = perf_counter()
+            record["lex"] = lexed - start
+            record["tokens"] = len(lex) - 1
+            instrumentation.add_time("lex", record["lex"])
+            instrumentation.count("tokens", record["tokens"])
+
+            cache = self.result_cache
+            key = None
+            if cache is not None:
+                key = tuple([(token.name, token.value) for token in lex])
+                resolved = cache.get(key)
+                if resolved is not None:
+                    record["cached"] = True
+                    instrumentation.count("result cache hits")
+                    return NumberWithUnit.from_exponents(resolved.num, resolved.exponents, resolved.denominator,
+                                                         self.cfg.base_units)
+
+            result = self.parser.parse_compact(lex, values=instrumentation.values)
+            record["parse"] = perf_counter() - lexed
+            instrumentation.add_time("parse", record["parse"])
+            instrumentation.count("shifts", record["tokens"])
+            if key is not None and type(result) is NumberWithUnit:
+                cache.put(key, ConfigReader.ResolvedUnit(result.num, result.exponents, result.denominator))
+            return result
+        except Exception as e:
+            record["error"] = self.error_kind(e)
+            instrumentation.count(f"{record['error']} errors")
+            raise
+        finally:
+            instrumentation.count("parses")
+            instrumentation.report(record)
+
+    """ the unit of an expression as Dimension, without computing its value, results are cached by the string and
+    by the tokens, the numbers are left out of the key, unless they can change the unit as exponents or
+    function arguments, so that e.g. "3 m/s" and "4.5 m / s" share an entry, unitless results keep their number,
+    so they are cached with the numbers in the key """
+    def dimension_of(self, data):
+        cache = self.dimension_cache
+        result = cache.get(data)
+        if result is not None:
+            return result
         lex = self.lexer.lex(data)
-        return self.parser.parse(lex, debug=debug)
+        key = tuple([(token.name, token.value) for token in lex])
+        if not any(token.name in ("pow", "func") for token in lex):
+            structure = tuple([(token.name, token.value if token.name != "num" else None) for token in lex])
+            result = cache.get(structure)
+            if result is None:
+                result = cache.get(key)
+        else:
+            structure = key
+            result = cache.get(key)
+        if result is None:
+            try:
+                result = self.parser.parse_compact(lex, values=self.dimension_values)
+            except DimensionFallback:
+                result = Dimension.of(self.parser.parse_compact(lex, values=self.values))
+            cache.put(key if result.is_unitless() else structure, result)
+        cache.put(data, result)
+        return result
+
+    """ string of a number with unit, using the prefixed base unit or derived unit of the config with the same
+    dimension, e.g. "3 kN" instead of "3000000 m g s^-2", see ConfigReader.best_unit, falls back to str(value) """
+    def format(self, value, constants=False):
+        if isinstance(value, str):
+            value = self.parse(value)
+        best = self.cfg.best_unit(value, constants)
+        if best is None:
+            return str(value)
+        num, prefix, unit = best
+        num = value.from_exponents(num, (0,) * len(value.exponents), 1, value.base_units)    # same type as value
+        return f"{num} {prefix.symbol}{unit.symbol}"
+
+    """ parse a string once, returns a callable that evaluates it for values of 'variables' """
+    def compile(self, data, variables=()):
+        return CompiledExpression(self, data, variables)
+
+    """ parse many strings, identical strings are only parsed once and share their result,
+    returns a list of results and a list of ParseError, both aligned with the input,
+    for every string exactly one of them is None """
+    def parse_many(self, strings):
+        return self.evaluate_many(strings, self.parse)
+
+    """ same as parse_many for dimension_of """
+    def dimension_of_many(self, strings):
+        return self.evaluate_many(strings, self.dimension_of)
+
+    def evaluate_many(self, strings, evaluate):
+        done = {}
+        results = []
+        errors = []
+        for data in strings:
+            entry = done.get(data)
+            if entry is None:
+                try:
+                    entry = (evaluate(data), None)
+                except Exception as e:
+                    entry = (None, self.parse_error(e))
+                done[data] = entry
+            results.append(entry[0])
+            errors.append(entry[1])
+        return results, errors
+
+    """ describe an exception raised by 'parse', the traceback is dropped to release its frames """
+    @staticmethod
+    def parse_error(exception):
+        return ParseError(UnitParser.error_kind(exception), getattr(exception, "pos", None),
+                          exception.with_traceback(None))
+
+    @staticmethod
+    def error_kind(exception):
+        for exception_type, name in ERROR_KINDS:
+            if isinstance(exception, exception_type):
+                return name
+        return "error"